@@ -0,0 +1,180 @@
+import csv
+import os
+from itertools import chain
+
+import numpy as np
+from PIL import Image
+
+# Terms that the stand-in NER models label as diseases and drugs
+DISEASE_TERMS = [
+    "fever",
+    "cancer",
+    "diabetes",
+    "asthma",
+    "hypertension",
+    "pneumonia",
+    "arthritis",
+    "migraine",
+    "anemia",
+    "hepatitis",
+]
+DRUG_TERMS = [
+    "aspirin",
+    "ibuprofen",
+    "metformin",
+    "insulin",
+    "paracetamol",
+    "warfarin",
+    "morphine",
+    "penicillin",
+    "atorvastatin",
+    "omeprazole",
+]
+COMMON_WORDS = [
+    "the",
+    "of",
+    "and",
+    "patient",
+    "with",
+    "was",
+    "in",
+    "to",
+    "a",
+    "for",
+    "treatment",
+    "dose",
+    "clinical",
+    "study",
+    "daily",
+    "follow-up",
+    "reported",
+    "severe",
+    "chronic",
+    "acute",
+]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "tu", "sen", "bol", "tri", "dex", "an", "or"]
+
+
+def make_vocabulary(size=5000, seed=0):
+    """
+    Builds a vocabulary of common words, disease and drug terms, and made-up words
+    of two to four syllables.
+
+    Args:
+        size (int): Number of made-up words to add.
+        seed (int): Seed for the random number generator.
+
+    Returns:
+        list: The words, most frequent first.
+    """
+    rng = np.random.default_rng(seed)
+    made_up = set()
+    while len(made_up) < size:
+        syllables = rng.choice(SYLLABLES, size=rng.integers(2, 5))
+        made_up.add("".join(syllables))
+    return COMMON_WORDS + DISEASE_TERMS + DRUG_TERMS + sorted(made_up)
+
+
+def iter_text_blocks(size_bytes, seed=0, words_per_block=200000):
+    """
+    Generates text of Zipf-distributed words from `make_vocabulary`, with a line
+    break after every 15 words on average.
+
+    Args:
+        size_bytes (int): Approximate total size of the text in bytes.
+        seed (int): Seed for the random number generator.
+        words_per_block (int): Number of words per generated block.
+
+    Yields:
+        str: The next block of text, ending with a line break.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(make_vocabulary(seed=seed), dtype=object)
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    probabilities = weights / weights.sum()
+
+    written = 0
+    while written < size_bytes:
+        words = vocabulary[
+            rng.choice(len(vocabulary), words_per_block, p=probabilities)
+        ]
+        separators = np.where(rng.random(words_per_block) < 1 / 15, "\n", " ")
+        separators[-1] = "\n"
+        block = "".join(chain.from_iterable(zip(words, separators)))
+        written += len(block)
+        yield block
+
+
+def generate_text_file(path, size_bytes, seed=0):
+    """
+    Writes a synthetic text file of about `size_bytes` bytes, like the output of
+    Task 1.
+
+    Args:
+        path (str): Path of the text file.
+        size_bytes (int): Approximate size of the file in bytes.
+        seed (int): Seed for the random number generator.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for block in iter_text_blocks(size_bytes, seed):
+            f.write(block)
+
+
+def generate_csv_corpus(directory, size_bytes, file_size=256 * 1024 * 1024, seed=0):
+    """
+    Writes synthetic CSV files with 'TEXT' and 'SHORT-TEXT' columns among others,
+    like the Task 1 input, totalling about `size_bytes` bytes.
+
+    Args:
+        directory (str): Directory to write the CSV files to.
+        size_bytes (int): Approximate total size of the files in bytes.
+        file_size (int): Approximate maximum size of each file in bytes.
+        seed (int): Seed for the random number generator.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    file_index = 0
+    f = None
+    writer = None
+    row_id = 0
+    for block in iter_text_blocks(size_bytes, seed):
+        if f is None or f.tell() >= file_size:
+            if f is not None:
+                f.close()
+            path = os.path.join(directory, f"corpus_{file_index:04d}.csv")
+            f = open(path, "w", newline="", encoding="utf-8")
+            writer = csv.writer(f)
+            writer.writerow(["ID", "TEXT", "SHORT-TEXT", "LABEL"])
+            file_index += 1
+
+        for line in block.splitlines():
+            writer.writerow([row_id, line, " ".join(line.split()[:3]), row_id % 7])
+            row_id += 1
+
+    if f is not None:
+        f.close()
+
+
+def generate_image(path, megapixels, seed=0, band_height=512):
+    """
+    Writes a synthetic RGB JPEG image of about `megapixels` million pixels, with a
+    gradient and noise so that it compresses like a photograph.
+
+    Args:
+        path (str): Path of the image file.
+        megapixels (float): Approximate number of pixels, in millions.
+        seed (int): Seed for the random number generator.
+        band_height (int): Number of rows generated at a time.
+    """
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)
+    for top in range(0, height, band_height):
+        rows = min(band_height, height - top)
+        noise = rng.integers(0, 56, size=(rows, width, 3), dtype=np.uint8)
+        pixels[top : top + rows] = noise + gradient.astype(np.uint8)[None, :, None]
+
+    Image.fromarray(pixels, "RGB").save(path, quality=90)
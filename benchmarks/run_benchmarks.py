@@ -0,0 +1,495 @@
+"""
+Benchmarks the hot path of each task on synthetic data with small local stand-in
+models, so that the results do not depend on the real datasets or on downloading
+models.
+
+Usage:
+    python -m benchmarks.run_benchmarks --scales small,medium
+    python -m benchmarks.run_benchmarks --save-baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.generators import (
+    generate_csv_corpus,
+    generate_image,
+    generate_text_file,
+)
+from benchmarks.stand_in_models import (
+    build_biobert_stand_in,
+    build_scispacy_stand_in,
+    build_tokenizer,
+)
+
+# Sizes of the synthetic data at each scale: the CSV corpus and text file in
+# bytes, the share of the text run through the NER models and the Caesar cipher,
+# and the image in megapixels
+SCALES = {
+    "small": {
+        "text_bytes": 1024 * 1024,
+        "ner_bytes": 256 * 1024,
+        "cipher_bytes": 256 * 1024,
+        "megapixels": 1,
+    },
+    "medium": {
+        "text_bytes": 100 * 1024 * 1024,
+        "ner_bytes": 1024 * 1024,
+        "cipher_bytes": 1024 * 1024,
+        "megapixels": 10,
+    },
+    "large": {
+        "text_bytes": 10 * 1024 * 1024 * 1024,
+        "ner_bytes": 4 * 1024 * 1024,
+        "cipher_bytes": 4 * 1024 * 1024,
+        "megapixels": 100,
+    },
+}
+
+
+def prepare_data(data_dir, scale):
+    """
+    Generates the synthetic data and stand-in models for a scale, unless they were
+    generated by an earlier run.
+
+    Args:
+        data_dir (str): Directory for the generated data.
+        scale (str): The scale name.
+
+    Returns:
+        dict: The paths of the generated data and models, and the scale's sizes.
+    """
+    sizes = SCALES[scale]
+    scale_dir = os.path.join(data_dir, scale)
+    models_dir = os.path.join(data_dir, "models")
+    os.makedirs(scale_dir, exist_ok=True)
+
+    paths = {
+        "csv_dir": os.path.join(scale_dir, "csv"),
+        "text_file": os.path.join(scale_dir, "text.txt"),
+        "ner_file": os.path.join(scale_dir, "ner_text.txt"),
+        "image_file": os.path.join(scale_dir, "image.jpg"),
+        "tokenizer": os.path.join(models_dir, "tokenizer"),
+        "biobert": os.path.join(models_dir, "biobert"),
+        "scispacy": os.path.join(models_dir, "scispacy"),
+        "output_dir": os.path.join(scale_dir, "output"),
+        **sizes,
+    }
+
+    if not os.path.isdir(paths["csv_dir"]):
+        print(f"Generating the {scale} CSV corpus...")
+        generate_csv_corpus(paths["csv_dir"], sizes["text_bytes"])
+    if not os.path.isfile(paths["text_file"]):
+        print(f"Generating the {scale} text file...")
+        generate_text_file(paths["text_file"], sizes["text_bytes"])
+    if not os.path.isfile(paths["ner_file"]):
+        generate_text_file(paths["ner_file"], sizes["ner_bytes"], seed=1)
+    if not os.path.isfile(paths["image_file"]):
+        print(f"Generating the {scale} image...")
+        generate_image(paths["image_file"], sizes["megapixels"])
+
+    build_tokenizer(paths["tokenizer"])
+    build_scispacy_stand_in(paths["scispacy"])
+    try:
+        build_biobert_stand_in(paths["biobert"])
+    except ImportError as e:
+        print(f"Skipping the BioBERT stand-in: {e}")
+
+    os.makedirs(paths["output_dir"], exist_ok=True)
+    return paths
+
+
+def bench_extract(paths):
+    from my_modules.q1_t1_extract_text import CSVTextExtractor
+
+    extractor = CSVTextExtractor(
+        paths["csv_dir"],
+        os.path.join(paths["output_dir"], "extracted_text.txt"),
+        ["TEXT", "SHORT-TEXT"],
+        chunk_size=100000,
+        workers=os.cpu_count(),
+    )
+    extractor.extract_text_from_csv_files()
+    return directory_size(paths["csv_dir"]), "B"
+
+
+def bench_words(paths):
+    from my_modules.q1_t3_1_most_common_words import TopWordsExtractor
+
+    extractor = TopWordsExtractor(
+        paths["text_file"],
+        os.path.join(paths["output_dir"], "top_30_words.csv"),
+        30,
+        block_size=1024 * 1024,
+        workers=os.cpu_count(),
+    )
+    extractor.extract_top_words()
+    return os.path.getsize(paths["text_file"]), "B"
+
+
+def bench_tokens(paths):
+    from my_modules.q1_t3_2_most_common_tokens import UniqueTokenCounter
+
+    token_counter = UniqueTokenCounter(
+        paths["text_file"],
+        os.path.join(paths["output_dir"], "top_30_tokens.csv"),
+        paths["tokenizer"],
+        30,
+        engine="bincount",
+    )
+    token_counter.count_unique_tokens()
+    return os.path.getsize(paths["text_file"]), "B"
+
+
+def bench_analytics(paths):
+    from my_modules.q1_t3_text_analytics import (
+        FusedTextAnalytics,
+        TokenCountAnalyzer,
+        WordCountAnalyzer,
+    )
+
+    analytics = FusedTextAnalytics(
+        paths["text_file"],
+        [
+            WordCountAnalyzer(os.path.join(paths["output_dir"], "words.csv"), 30),
+            TokenCountAnalyzer(
+                os.path.join(paths["output_dir"], "tokens.csv"), 30, paths["tokenizer"]
+            ),
+        ],
+    )
+    analytics.run()
+    return os.path.getsize(paths["text_file"]), "B"
+
+
+def bench_ner_biobert(paths):
+    from my_modules.q1_t4_named_entity_recognition import NERProcessor
+
+    biobert_ner = NERProcessor(
+        paths["ner_file"],
+        os.path.join(paths["output_dir"], "ner_biobert_results.csv"),
+        paths["biobert"],
+        "biobert",
+        chunking="tokens",
+    )
+    biobert_ner.perform_ner()
+    return os.path.getsize(paths["ner_file"]), "B"
+
+
+def bench_ner_scispacy(paths):
+    from my_modules.q1_t4_named_entity_recognition import NERProcessor
+
+    scispacy_ner = NERProcessor(
+        paths["ner_file"],
+        os.path.join(paths["output_dir"], "ner_scispacy_results.csv"),
+        paths["scispacy"],
+        "scispacy",
+    )
+    scispacy_ner.perform_ner()
+    return os.path.getsize(paths["ner_file"]), "B"
+
+
+def bench_gatekeeper(paths):
+    from PIL import Image
+
+    from my_modules.q2_c1_gatekeeper import ImageModifier
+
+    modifier = ImageModifier(
+        paths["image_file"], os.path.join(paths["output_dir"], "image_out.jpg")
+    )
+    modifier.modify_image(n=100)
+    with Image.open(paths["image_file"]) as image:
+        return image.width * image.height, "px"
+
+
+def bench_caesar(paths):
+    from my_modules.q3_encrypted import CaesarCipher
+
+    with open(paths["text_file"], "r", encoding="utf-8") as f:
+        text = f.read(paths["cipher_bytes"])
+    cipher = CaesarCipher()
+    cipher.decrypt(cipher.encrypt(text))
+    return len(text), "char"
+
+
+# Each benchmark runs a task on the data from `prepare_data`, and returns the
+# amount of input it processed and the unit of that amount
+BENCHMARKS = {
+    "extract": bench_extract,
+    "words": bench_words,
+    "tokens": bench_tokens,
+    "analytics": bench_analytics,
+    "ner-biobert": bench_ner_biobert,
+    "ner-scispacy": bench_ner_scispacy,
+    "gatekeeper": bench_gatekeeper,
+    "caesar": bench_caesar,
+}
+
+
+def directory_size(directory):
+    """
+    Returns the total size of the files in a directory in bytes.
+    """
+    return sum(
+        os.path.getsize(os.path.join(directory, file)) for file in os.listdir(directory)
+    )
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of this process in bytes, or None where the
+    platform does not report it.
+
+    On Linux, the high-water mark of the process' own memory is read from /proc,
+    because `ru_maxrss` also counts the memory of the parent process it was forked
+    from.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def peak_worker_rss():
+    """
+    Returns the peak resident memory of the largest finished worker process in
+    bytes, or None where the platform does not report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale or None
+
+
+def run_benchmark(name, paths):
+    """
+    Runs one benchmark and measures it. Runs in a fresh process, so that the peak
+    memory and the imports are those of the benchmark alone.
+
+    Args:
+        name (str): The benchmark name.
+        paths (dict): The data and model paths from `prepare_data`.
+
+    Returns:
+        dict: The seconds, CPU seconds, amount processed, throughput and peak
+            memory of the run.
+    """
+    # Silence the progress bars, and use only the local stand-in models
+    os.environ["TQDM_DISABLE"] = "1"
+    os.environ["HF_HUB_OFFLINE"] = "1"
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        amount, unit = BENCHMARKS[name](paths)
+    seconds = time.perf_counter() - start_time
+
+    return {
+        "seconds": seconds,
+        "cpu_seconds": time.process_time() - start_cpu,
+        "amount": amount,
+        "unit": unit,
+        "throughput": amount / max(seconds, 1e-9),
+        "peak_rss": peak_rss(),
+        "peak_worker_rss": peak_worker_rss(),
+    }
+
+
+def run_benchmarks(scales, names, data_dir, repeat):
+    """
+    Runs the benchmarks at each scale, each run in a fresh process, keeping the
+    fastest of `repeat` runs.
+
+    Returns:
+        dict: The results by '<scale>/<benchmark>'.
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for scale in scales:
+        paths = prepare_data(data_dir, scale)
+        for name in names:
+            key = f"{scale}/{name}"
+            best = None
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    try:
+                        result = executor.submit(run_benchmark, name, paths).result()
+                    except Exception as e:
+                        best = {"error": f"{type(e).__name__}: {e}"}
+                        break
+                if best is None or result["seconds"] < best["seconds"]:
+                    best = result
+
+            results[key] = best
+            print_result(key, best)
+
+    return results
+
+
+def print_result(key, result):
+    if "error" in result:
+        print(f"{key:<24} error: {result['error']}")
+        return
+
+    peak_rss_text = (
+        f"{result['peak_rss'] / (1024 * 1024):8.1f} MB" if result["peak_rss"] else ""
+    )
+    print(
+        f"{key:<24} {result['seconds']:9.3f}s "
+        f"{format_throughput(result['throughput'], result['unit']):>14} "
+        f"{peak_rss_text}"
+    )
+
+
+def format_throughput(throughput, unit):
+    for prefix in ("", "K", "M", "G"):
+        if throughput < 1000 or prefix == "G":
+            return f"{throughput:.1f} {prefix}{unit}/s"
+        throughput /= 1000
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Compares the seconds of each benchmark with the baseline and prints the change.
+
+    Args:
+        results (dict): The results by '<scale>/<benchmark>'.
+        baseline (dict): The baseline results in the same form.
+        threshold (float): Relative slowdown above which a benchmark counts as a
+            regression, e.g. 0.1 for 10%.
+
+    Returns:
+        list: The keys of the benchmarks that regressed.
+    """
+    regressions = []
+    print(f"\nComparison with the baseline (threshold {threshold:.0%})")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base or "error" in base or "error" in result:
+            print(f"{key:<24} {'no comparison':>12}")
+            continue
+
+        change = result["seconds"] / max(base["seconds"], 1e-9) - 1
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(key)
+        elif change < -threshold:
+            status = "faster"
+        else:
+            status = "unchanged"
+        print(
+            f"{key:<24} {base['seconds']:9.3f}s -> {result['seconds']:9.3f}s "
+            f"{change:+8.1%}  {status}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark each task on synthetic data with local stand-in models."
+    )
+    parser.add_argument(
+        "--scales",
+        default="small",
+        help=f"comma-separated scales from: {', '.join(SCALES)} (default: small)",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        default=",".join(BENCHMARKS),
+        help=f"comma-separated benchmarks from: {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default="./benchmarks/data",
+        help="directory for the generated data and models",
+    )
+    parser.add_argument(
+        "--output",
+        default="./benchmarks/results/latest.json",
+        help="JSON file to write the results to",
+    )
+    parser.add_argument(
+        "--baseline",
+        default="./benchmarks/baseline.json",
+        help="JSON file with the baseline results to compare against",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="also write the results to the baseline file",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown that counts as a regression (default: 0.1)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs per benchmark, keeping the fastest"
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="exit with status 1 if any benchmark regressed",
+    )
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    for value, choices in ((scales, SCALES), (names, BENCHMARKS)):
+        unknown = [item for item in value if item not in choices]
+        if unknown:
+            parser.error(f"Unknown choice(s): {', '.join(unknown)}")
+
+    results = run_benchmarks(scales, names, args.data_dir, args.repeat)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    output_files = [args.output] + ([args.baseline] if args.save_baseline else [])
+    for output_file in output_files:
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output_file}")
+
+    regressions = []
+    if not args.save_baseline and os.path.isfile(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
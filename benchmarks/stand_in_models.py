@@ -0,0 +1,120 @@
+import os
+import string
+
+from benchmarks.generators import DISEASE_TERMS, DRUG_TERMS, make_vocabulary
+
+# Labels in the format of the BC5CDR models used by Task 4
+BIOBERT_LABELS = ["O", "B-Disease", "I-Disease", "B-Chemical", "I-Chemical"]
+
+
+def write_vocabulary_file(path):
+    """
+    Writes a WordPiece vocabulary that covers the synthetic corpus: the special
+    tokens, every vocabulary word, and single characters as a fallback.
+    """
+    special_tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    characters = list(string.ascii_lowercase + string.digits + string.punctuation)
+    words = sorted({word.lower() for word in make_vocabulary()})
+    with open(path, "w", encoding="utf-8") as f:
+        for token in chain_unique(
+            special_tokens, characters, [f"##{c}" for c in characters], words
+        ):
+            f.write(token + "\n")
+
+
+def chain_unique(*groups):
+    """
+    Yields the items of the groups in order, skipping repeats.
+    """
+    seen = set()
+    for group in groups:
+        for item in group:
+            if item not in seen:
+                seen.add(item)
+                yield item
+
+
+def build_tokenizer(directory):
+    """
+    Builds a small uncased BERT tokenizer for the synthetic corpus, standing in
+    for 'distilbert-base-uncased' in Task 3.2.
+
+    Args:
+        directory (str): Directory to save the tokenizer to.
+
+    Returns:
+        str: The directory, to pass as the model name.
+    """
+    from transformers import BertTokenizerFast
+
+    if os.path.isfile(os.path.join(directory, "tokenizer.json")):
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+    vocabulary_file = os.path.join(directory, "vocab.txt")
+    write_vocabulary_file(vocabulary_file)
+    tokenizer = BertTokenizerFast(vocab_file=vocabulary_file, do_lower_case=True)
+    tokenizer.save_pretrained(directory)
+    return directory
+
+
+def build_biobert_stand_in(directory):
+    """
+    Builds a tiny, randomly initialized BERT token classification model with the
+    BC5CDR labels, standing in for the BioBERT model of Task 4. Its predictions
+    are meaningless, but it runs the same code paths much faster and offline.
+
+    Args:
+        directory (str): Directory to save the model and tokenizer to.
+
+    Returns:
+        str: The directory, to pass as the model name.
+    """
+    from transformers import BertConfig, BertForTokenClassification
+
+    if os.path.isfile(os.path.join(directory, "config.json")):
+        return directory
+
+    build_tokenizer(directory)
+    with open(os.path.join(directory, "vocab.txt"), encoding="utf-8") as f:
+        vocab_size = sum(1 for _ in f)
+
+    config = BertConfig(
+        vocab_size=vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        max_position_embeddings=512,
+        id2label=dict(enumerate(BIOBERT_LABELS)),
+        label2id={label: index for index, label in enumerate(BIOBERT_LABELS)},
+    )
+    BertForTokenClassification(config).save_pretrained(directory)
+    return directory
+
+
+def build_scispacy_stand_in(directory):
+    """
+    Builds a blank English spaCy pipeline whose 'ner' component is an entity ruler
+    that labels the synthetic disease and drug terms, standing in for the scispaCy
+    model of Task 4.
+
+    Args:
+        directory (str): Directory to save the pipeline to.
+
+    Returns:
+        str: The directory, to pass as the model name.
+    """
+    import spacy
+
+    if os.path.isfile(os.path.join(directory, "config.cfg")):
+        return directory
+
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler", name="ner")
+    ruler.add_patterns(
+        [{"label": "DISEASE", "pattern": [{"LOWER": term}]} for term in DISEASE_TERMS]
+        + [{"label": "CHEMICAL", "pattern": [{"LOWER": term}]} for term in DRUG_TERMS]
+    )
+    nlp.to_disk(directory)
+    return directory
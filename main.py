@@ -9,15 +9,23 @@ GitHub repository:
     https://github.com/k3vjnh0/HIT137-SoftwareNow-Assignment-2-CAS309.git
 """
 
+import argparse
+import multiprocessing
+import os
+import sys
+
 from my_modules.helper import check_input_conditions, clear_screen, get_encrypted_text
-from my_modules.q1_t1_extract_text import CSVTextExtractor
-from my_modules.q1_t2_research import TextProcessor
+from my_modules.metrics import metrics
+from my_modules.model_registry import model_registry
+from my_modules.pipeline import TaskPipeline
 from my_modules.q1_t3_1_most_common_words import TopWordsExtractor
-from my_modules.q1_t3_2_most_common_tokens import UniqueTokenCounter
-from my_modules.q1_t4_named_entity_recognition import NERProcessor
-from my_modules.q2_c1_gatekeeper import ImageModifier
 from my_modules.q2_c2_chamber_of_strings import StringCipherProcessor
 from my_modules.q3_encrypted import CaesarCipher
+from my_modules.startup_times import measure_import_times
+
+# The modules that depend on pandas, numpy, Pillow, spaCy, torch or transformers
+# are imported inside the tasks that use them, so the menu starts without loading
+# them
 
 
 def main_menu():
@@ -60,9 +68,12 @@ class MenuManager:
             "4": ("Task 3.2 - Tokenize Text", task3_2_tokenize_text),
             "5": ("Task 4 - Named Entity Recognition - BioBert", task4_ner_biobert),
             "6": ("Task 4 - Named Entity Recognition - SciSpaCy", task4_ner_scispacy),
-            "7": ("Return to Main Menu", None),
+            "7": ("Task 4 - BioBert Backend Parity Check", task4_biobert_parity),
+            "8": ("Task 4 - BioBert Sharding Tuning Report", task4_biobert_tuning),
+            "9": ("Task 3 - Count Words and Tokens in One Pass", task3_text_analytics),
+            "10": ("Return to Main Menu", None),
         }
-        self.process_sub_menu("QUESTION 1 - NLP TASKS", q1_options, "7")
+        self.process_sub_menu("QUESTION 1 - NLP TASKS", q1_options, "10")
 
     def handle_question_2(self):
         q2_options = {
@@ -72,9 +83,11 @@ class MenuManager:
                 chapter2_the_chamber_of_strings_ascii,
             ),
             "3": ("Chapter 2 - Deciphered Cryptogram", chapter2_deciphered_cryptogram),
-            "4": ("Return to Main Menu", None),
+            "4": ("Chapter 1 - The Gatekeeper (Batch)", chapter1_the_gatekeeper_batch),
+            "5": ("Chapter 1 - Red Sums for Every Number", chapter1_red_sums),
+            "6": ("Return to Main Menu", None),
         }
-        self.process_sub_menu("QUESTION 2 - THE HIDDEN TREASURE", q2_options, "4")
+        self.process_sub_menu("QUESTION 2 - THE HIDDEN TREASURE", q2_options, "6")
 
     def handle_question_3(self):
         fixing_error_prone_codes()
@@ -99,7 +112,9 @@ class MenuManager:
                 ):  # Check if the selected option is to return to main menu
                     break  # Exit the submenu immediately and return to main menu
                 else:
-                    options[choice][1]()
+                    task = options[choice][1]
+                    with metrics.task(task.__name__):
+                        task()
                     if self.prompt_to_stay_in_submenu():
                         break
 
@@ -119,6 +134,7 @@ class MenuManager:
                 print("Invalid input. Please enter 'y' or 'n'.")
 
     def exit_program(self):
+        model_registry.print_report()
         print("Exiting program.")
         exit()
 
@@ -130,14 +146,23 @@ class MenuManager:
 
 
 def task1_extract_text():
+    from my_modules.q1_t1_extract_text import CSVTextExtractor
+
     print("\nRunning Task 1: Extract 'text' from csv files")
     extractor = CSVTextExtractor(
-        "./input", "./output/extracted_text.txt", ["TEXT", "SHORT-TEXT"]
+        "./input",
+        "./output/extracted_text.txt",
+        ["TEXT", "SHORT-TEXT"],
+        chunk_size=100000,
+        workers=os.cpu_count(),
+        manifest_file="./output/extracted_text.manifest.json",
     )
     extractor.extract_text_from_csv_files()
 
 
 def taks2_research():
+    from my_modules.q1_t2_research import TextProcessor
+
     print("\nRunning Task 2: Research")
     processor = TextProcessor()
     sample_text = "Aspirin is a medication used to reduce pain, fever, or inflammation."
@@ -145,53 +170,181 @@ def taks2_research():
     processor.tokenize_with_biobert(sample_text)
 
 
-def task3_1_count_word():
+def task3_1_count_word(text=None):
     print("\nRunning Task 3.1: Count Words and Save Top 30 Words")
     extractor = TopWordsExtractor(
-        "./output/extracted_text.txt", "./output/top_30_words.csv", 30
+        "./output/extracted_text.txt",
+        "./output/top_30_words.csv",
+        30,
+        block_size=1024 * 1024,
+        workers=os.cpu_count(),
+        cache_dir="./output/.cache",
     )
-    extractor.extract_top_words()
+    extractor.extract_top_words(text)
+
 
+def task3_2_tokenize_text(text=None):
+    from my_modules.q1_t3_2_most_common_tokens import UniqueTokenCounter
 
-def task3_2_tokenize_text():
     print("\nRunning Task 3.2: Tokenize Text and Save Top 30 Tokens")
     token_counter = UniqueTokenCounter(
         "./output/extracted_text.txt",
         "./output/top_30_tokens.csv",
         "distilbert-base-uncased",
         30,
+        engine="bincount",
+        cache_dir="./output/.cache",
     )
-    token_counter.count_unique_tokens()
+    token_counter.count_unique_tokens(text)
 
 
-def task4_ner_biobert():
+def task3_text_analytics(text=None):
+    from my_modules.q1_t3_text_analytics import (
+        CharNgramAnalyzer,
+        FusedTextAnalytics,
+        TokenCountAnalyzer,
+        WordCountAnalyzer,
+    )
+
+    print("\nRunning Task 3: Count Words, Tokens and Character Trigrams in One Pass")
+    # Separate file names, as the words and tokens tasks can run at the same time
+    analytics = FusedTextAnalytics(
+        "./output/extracted_text.txt",
+        [
+            WordCountAnalyzer("./output/top_30_words_one_pass.csv", 30),
+            TokenCountAnalyzer(
+                "./output/top_30_tokens_one_pass.csv", 30, "distilbert-base-uncased"
+            ),
+            CharNgramAnalyzer("./output/top_30_trigrams.csv", 30, n=3),
+        ],
+    )
+    analytics.run(text)
+
+
+def task4_ner_biobert(text=None):
+    from my_modules.q1_t4_named_entity_recognition import NERProcessor
+
     print("\nRunning Task 4: NER with BioBert")
     biobert_ner = NERProcessor(
         "./output/extracted_text.txt",
         "./output/ner_biobert_results.csv",
         "judithrosell/BioBERT_BC5CDR_NER_new",
         "biobert",
+        chunking="tokens",
+        cache_file="./output/.cache/ner_chunks.sqlite",
+    )
+    biobert_ner.perform_ner(text)
+
+
+def task4_biobert_parity():
+    from my_modules.q1_t4_named_entity_recognition import NERProcessor
+
+    print("\nRunning Task 4: BioBert Backend Parity Check")
+    # The backends are compared against 'pytorch', so only the others can be checked
+    while True:
+        backend = input(
+            "Enter the backend to check (quantized/onnx, default quantized): "
+        )
+        backend = backend.strip().lower() or "quantized"
+        if backend in ("quantized", "onnx"):
+            break
+        print("Invalid input. Please enter 'quantized' or 'onnx'.")
+    if not os.path.isfile("./output/extracted_text.txt"):
+        print("Error: The file './output/extracted_text.txt' does not exist.")
+        return
+    # Check the backends on the start of the extracted text
+    with open("./output/extracted_text.txt", "r", encoding="utf-8") as text_file:
+        sample_text = text_file.read(50000)
+    biobert_ner = NERProcessor(
+        "./output/extracted_text.txt",
+        "./output/ner_biobert_results.csv",
+        "judithrosell/BioBERT_BC5CDR_NER_new",
+        "biobert",
+        chunking="tokens",
+        backend=backend,
+        onnx_dir="./output/.cache/onnx",
     )
-    biobert_ner.perform_ner()
+    biobert_ner.check_backend_parity(sample_text)
 
 
-def task4_ner_scispacy():
+def task4_biobert_tuning():
+    from my_modules.q1_t4_named_entity_recognition import NERProcessor
+
+    print("\nRunning Task 4: BioBert Sharding Tuning Report")
+    if not os.path.isfile("./output/extracted_text.txt"):
+        print("Error: The file './output/extracted_text.txt' does not exist.")
+        return
+    # Measure the throughput on the start of the extracted text, large enough to
+    # keep every worker busy for a while
+    with open("./output/extracted_text.txt", "r", encoding="utf-8") as text_file:
+        sample_text = text_file.read(500000)
+    biobert_ner = NERProcessor(
+        "./output/extracted_text.txt",
+        "./output/ner_biobert_results.csv",
+        "judithrosell/BioBERT_BC5CDR_NER_new",
+        "biobert",
+        chunking="tokens",
+    )
+    cpu_count = os.cpu_count() or 1
+    configurations = []
+    workers = 1
+    while workers <= cpu_count:
+        configurations.append((workers, max(1, cpu_count // workers)))
+        workers *= 2
+    biobert_ner.tune_biobert_sharding(sample_text, configurations)
+
+
+def task4_ner_scispacy(text=None):
+    from my_modules.q1_t4_named_entity_recognition import NERProcessor
+
     print("\nRunning Task 4: NER with SciSpaCy")
     scispacy_ner = NERProcessor(
         "./output/extracted_text.txt",
         "./output/ner_scispacy_results.csv",
         "en_ner_bc5cdr_md",
         "scispacy",
+        n_process=os.cpu_count(),
+        cache_file="./output/.cache/ner_chunks.sqlite",
     )
-    scispacy_ner.perform_ner()
+    scispacy_ner.perform_ner(text)
 
 
 def chapter1_the_gatekeeper():
+    from my_modules.q2_c1_gatekeeper import ImageModifier
+
     print("\nRunning Chapter 1: The Gatekeeper")
     modifer = ImageModifier("./input/chapter1.jpg", "./output/chapter1out.jpg")
     modifer.modify_image()
 
 
+def chapter1_the_gatekeeper_batch():
+    from my_modules.q2_c1_gatekeeper import ImageBatchModifier
+
+    print("\nRunning Chapter 1: The Gatekeeper - Batch")
+    input_path = input("Enter the image directory or glob pattern (default ./input): ")
+    output_dir = input("Enter the output directory (default ./output/chapter1_batch): ")
+    n = check_input_conditions("Enter the number to add to each pixel value: ")
+    batch_modifier = ImageBatchModifier(
+        input_path or "./input",
+        output_dir or "./output/chapter1_batch",
+        n,
+        "./output/chapter1_batch_report.csv",
+    )
+    batch_modifier.modify_images()
+
+
+def chapter1_red_sums():
+    from my_modules.q2_c1_gatekeeper import ImageModifier
+
+    print("\nRunning Chapter 1: The Gatekeeper - Red Sums for Every Number")
+    modifer = ImageModifier("./input/chapter1.jpg", "./output/chapter1out.jpg")
+    red_sums = modifer.red_sums_for_all_numbers()
+    if red_sums is None:
+        return
+    for n, sum_red_pixels in red_sums.items():
+        print(f"n = {n}: the sum of all red pixels is {sum_red_pixels}")
+
+
 def chapter2_the_chamber_of_strings_ascii():
     print("\nRunning Chapter 2: The Chamber of Strings - ASCII code")
     # Example string
@@ -281,6 +434,153 @@ def show_github_repository():
     input("Press Enter to return to the main menu.")
 
 
+def load_extracted_text():
+    """
+    Loads the text extracted by Task 1, so that the pipeline tasks can share it in
+    memory instead of each reading the file.
+    """
+    with open("./output/extracted_text.txt", "r", encoding="utf-8") as text_file:
+        return text_file.read()
+
+
+def run_pipeline(task_names, workers=None):
+    pipeline = TaskPipeline(workers)
+    pipeline.add_task("extract", lambda results: task1_extract_text())
+    pipeline.add_task(
+        "corpus", lambda results: load_extracted_text(), after=("extract",)
+    )
+    pipeline.add_task(
+        "words",
+        lambda results: task3_1_count_word(results["corpus"]),
+        requires=("corpus",),
+    )
+    pipeline.add_task(
+        "tokens",
+        lambda results: task3_2_tokenize_text(results["corpus"]),
+        requires=("corpus",),
+    )
+    pipeline.add_task(
+        "analytics",
+        lambda results: task3_text_analytics(results["corpus"]),
+        requires=("corpus",),
+    )
+    pipeline.add_task(
+        "ner-biobert",
+        lambda results: task4_ner_biobert(results["corpus"]),
+        requires=("corpus",),
+    )
+    pipeline.add_task(
+        "ner-scispacy",
+        lambda results: task4_ner_scispacy(results["corpus"]),
+        requires=("corpus",),
+    )
+    pipeline.add_task("gatekeeper", lambda results: chapter1_the_gatekeeper())
+
+    report = pipeline.run(task_names)
+    model_registry.print_report()
+    return all(row["status"] == "done" for row in report.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="HIT137 Assignment 2 - CAS 309. Runs the interactive menu by "
+        "default."
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="JSON lines file to append per-stage metrics to: wall and CPU time, "
+        "bytes, items per second and peak memory",
+    )
+    parser.add_argument(
+        "--memory",
+        choices=["rss", "tracemalloc", "none"],
+        default="rss",
+        help="how to measure the peak memory of each stage (default: rss)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="TASK",
+        help="profile one task: a pipeline task name such as 'words', or a menu "
+        "task function name such as 'task3_1_count_word'",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=["cprofile", "pyinstrument"],
+        default="cprofile",
+        help="the profiler to use with --profile (default: cprofile)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default="./output/profiles",
+        help="directory to save profiles to (default: %(default)s)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("menu", help="run the interactive menu")
+    startup_parser = subparsers.add_parser(
+        "startup-times",
+        help="measure how long the menu and each task module take to import",
+    )
+    startup_parser.add_argument(
+        "--output",
+        default="./output/startup_times.jsonl",
+        help="JSON lines file to append the measurements to",
+    )
+    startup_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of fresh interpreters to measure each module in",
+    )
+    pipeline_parser = subparsers.add_parser(
+        "pipeline",
+        help="run tasks without the menu, running independent tasks concurrently",
+    )
+    pipeline_parser.add_argument(
+        "--tasks",
+        default="extract,words,tokens,ner-scispacy",
+        help="comma-separated tasks to run, from: extract, words, tokens, "
+        "analytics, ner-biobert, ner-scispacy, gatekeeper. Tasks that read the extracted "
+        "text run after 'extract' if it is selected, or else use the existing "
+        "./output/extracted_text.txt (default: %(default)s)",
+    )
+    pipeline_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="maximum number of tasks to run at the same time",
+    )
+    args = parser.parse_args()
+
+    metrics.configure(
+        args.metrics_file,
+        memory=None if args.memory == "none" else args.memory,
+        profiled_task=args.profile,
+        profile_dir=args.profile_dir,
+        profiler=args.profiler,
+    )
+
+    if args.command == "pipeline":
+        # The tasks run in threads, and libraries such as spaCy start their own
+        # worker processes with the default context, so fork is never safe here
+        multiprocessing.set_start_method("spawn", force=True)
+        task_names = [name.strip() for name in args.tasks.split(",") if name.strip()]
+        try:
+            succeeded = run_pipeline(task_names, args.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(0 if succeeded else 1)
+    elif args.command == "startup-times":
+        measure_import_times(
+            args.output,
+            repeat=args.repeat,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    else:
+        menu_manager = MenuManager()
+        menu_manager.run()
+
+
 if __name__ == "__main__":
-    menu_manager = MenuManager()
-    menu_manager.run()
+    main()
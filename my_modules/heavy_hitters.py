@@ -0,0 +1,123 @@
+import heapq
+from collections import Counter
+from itertools import count
+
+
+class SpaceSaving:
+    """
+    A bounded-memory summary of the most frequent items in a stream, using the
+    Space-Saving algorithm.
+
+    At most `capacity` items are tracked. When a new item arrives and the summary is
+    full, the item with the smallest count is replaced, and the new item inherits
+    that count as its possible overestimation. Every reported count is at least the
+    true count and overestimates it by at most the reported error, which is never
+    more than `total / capacity`. Any item that occurs more than `total / capacity`
+    times is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initialize the SpaceSaving instance.
+
+        Args:
+            capacity (int): Maximum number of items to track. Memory use is
+                proportional to this number.
+        """
+        if capacity < 1:
+            raise ValueError("The capacity must be a positive integer.")
+
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+
+        # Min-heap of (count, sequence, item); stale entries are skipped lazily
+        self._heap = []
+        self._sequence = count()
+
+    def update(self, items):
+        """
+        Adds items to the summary, like `Counter.update`.
+
+        Args:
+            items (iterable or mapping): The items to add, or a mapping of items to
+                their counts.
+        """
+        if not hasattr(items, "items"):
+            # Aggregate first so that each distinct item is added only once
+            items = Counter(items)
+
+        for item, weight in items.items():
+            self.add(item, weight)
+
+    def add(self, item, weight=1):
+        """
+        Adds an item to the summary.
+
+        Args:
+            item: The item to add.
+            weight (int): How many times the item occurred.
+        """
+        self.total += weight
+
+        if item in self.counts:
+            self.counts[item] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+        else:
+            # Replace the item with the smallest count
+            min_count, min_item = self._pop_min()
+            del self.counts[min_item]
+            del self.errors[min_item]
+            self.counts[item] = min_count + weight
+            self.errors[item] = min_count
+
+        self._push(item)
+
+    def most_common(self, n=None):
+        """
+        Lists the tracked items from the highest to the lowest count.
+
+        Args:
+            n (int, optional): Number of items to list. Lists all if None.
+
+        Returns:
+            list: (item, count) tuples.
+        """
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def most_common_with_errors(self, n=None):
+        """
+        Lists the tracked items from the highest to the lowest count, with the
+        maximum amount by which each count may overestimate the true count.
+
+        Args:
+            n (int, optional): Number of items to list. Lists all if None.
+
+        Returns:
+            list: (item, count, error) tuples.
+        """
+        return [
+            (item, item_count, self.errors[item])
+            for item, item_count in self.most_common(n)
+        ]
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counts[item], next(self._sequence), item))
+
+        # Rebuild the heap when stale entries start to dominate it
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [
+                (item_count, next(self._sequence), tracked_item)
+                for tracked_item, item_count in self.counts.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            item_count, _, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == item_count:
+                return item_count, item
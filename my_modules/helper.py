@@ -1,4 +1,7 @@
+import hashlib
+import multiprocessing
 import os
+import threading
 
 
 def clear_screen():
@@ -30,6 +33,39 @@ def load_text_from_file(file_path):
         return None
 
 
+def hash_file(file_path, block_size=1024 * 1024):
+    """
+    Compute the SHA-256 hash of a file's content.
+
+    Args:
+        file_path (str): Path to the file.
+        block_size (int): Number of bytes to read at a time.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def process_pool_context():
+    """
+    Returns the multiprocessing context for a process pool. Pools started from a
+    thread other than the main thread, such as a pipeline task, use 'spawn', as
+    forking while other threads are running can copy a held lock into the child
+    and deadlock it. Otherwise the platform default is used.
+
+    Returns:
+        BaseContext: The multiprocessing context.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return multiprocessing.get_context("spawn")
+    return multiprocessing.get_context()
+
+
 def ensure_paths(input_file_path, output_file_path):
     """
     Ensures the input file exists and the output directory is ready.
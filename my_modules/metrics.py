@@ -0,0 +1,365 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Stage:
+    """
+    The measurements of one running stage. Tasks add the amounts they processed,
+    such as bytes read or tokens counted, with `add`.
+    """
+
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = dict(counts)
+
+    def add(self, **counts):
+        """
+        Adds to the amounts processed by the stage, e.g. `add(bytes_read=1024)`.
+        """
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+
+class MetricsRecorder:
+    """
+    A class to measure the stages of the tasks and write one JSON line per stage
+    to a metrics file: its wall time, CPU time, the amounts it processed and their
+    rates per second, and its peak memory.
+
+    A stage's `cpu_seconds` is the CPU time of the thread running it, plus that of
+    the child processes, such as process pool workers, that exited during the
+    stage. Child processes are only accounted per process, so they can include the
+    workers of another stage running at the same time. `process_cpu_seconds` is
+    the CPU time of the whole process, which also covers native threads, such as
+    those of the tokenizers, but also the other stages running at the same time.
+
+    Recording is off until `configure` is called with a metrics file, and stages
+    then cost only a few clock reads. A single task can also be profiled.
+    """
+
+    def __init__(self):
+        self.output_file = None
+        self.memory = None
+        self.profiled_task = None
+        self.profile_dir = None
+        self.profiler = "cprofile"
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.active_stages = set()
+        self.resets_peak_rss = False
+
+    def configure(
+        self,
+        output_file=None,
+        memory="rss",
+        profiled_task=None,
+        profile_dir="./output/profiles",
+        profiler="cprofile",
+    ):
+        """
+        Turns recording on or off, and selects a task to profile.
+
+        Args:
+            output_file (str, optional): JSON lines file to append the stage
+                records to. Recording is off if None.
+            memory (str, optional): How to measure peak memory: 'rss' for the
+                process' peak resident memory during each stage, 'tracemalloc' for
+                the peak of the Python allocations during each stage, which is
+                exact but slows the tasks down, or None to skip it. Stages that run
+                at the same time in different threads share their peaks. Where the
+                peak resident memory cannot be reset for each stage, which needs
+                Linux, the peak since the process started is recorded as
+                `process_peak_rss_bytes` instead.
+            profiled_task (str, optional): The name of a task to profile when it
+                runs, as passed to `task`.
+            profile_dir (str): Directory to save the profile to.
+            profiler (str): The profiler to use ('cprofile' or 'pyinstrument').
+        """
+        if memory not in ("rss", "tracemalloc", None):
+            raise ValueError("Invalid memory mode. Choose 'rss' or 'tracemalloc'.")
+        if profiler not in ("cprofile", "pyinstrument"):
+            raise ValueError("Invalid profiler. Choose 'cprofile' or 'pyinstrument'.")
+
+        self.output_file = output_file
+        self.memory = memory if output_file else None
+        self.profiled_task = profiled_task
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+
+        if self.output_file:
+            output_dir = os.path.dirname(self.output_file)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+        if self.memory == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.resets_peak_rss = self.memory == "rss" and reset_peak_rss()
+
+    @property
+    def enabled(self):
+        return self.output_file is not None
+
+    @contextmanager
+    def task(self, name):
+        """
+        Measures a whole task as a stage, and profiles it if it is the task
+        selected with `configure`.
+
+        Args:
+            name (str): The task name.
+
+        Yields:
+            Stage: The stage of the task.
+        """
+        with self.stage(name) as stage:
+            if name == self.profiled_task:
+                with profile_task(name, self.profile_dir, self.profiler):
+                    yield stage
+            else:
+                yield stage
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """
+        Measures a stage of a task.
+
+        Args:
+            name (str): The stage name.
+            **counts: Amounts already known when the stage starts, such as the
+                bytes of its input.
+
+        Yields:
+            Stage: The stage, to add the amounts processed to.
+        """
+        stage = Stage(name, counts)
+        if not self.enabled:
+            yield stage
+            return
+
+        stack = self.local.__dict__.setdefault("stack", [])
+        parent = stack[-1] if stack else None
+        stack.append(stage)
+
+        if self.memory == "tracemalloc":
+            # Keep the peak of the enclosing stage before restarting the peak
+            if parent is not None:
+                parent.traced_peak = max(
+                    getattr(parent, "traced_peak", 0),
+                    tracemalloc.get_traced_memory()[1],
+                )
+            tracemalloc.reset_peak()
+        elif self.resets_peak_rss:
+            self.start_peak_rss(stage)
+
+        start_timestamp = time.time()
+        start_time = time.perf_counter()
+        start_cpu = time.thread_time()
+        start_children_cpu = children_cpu_time()
+        start_process_cpu = time.process_time()
+        try:
+            yield stage
+        finally:
+            wall_seconds = time.perf_counter() - start_time
+            cpu_seconds = time.thread_time() - start_cpu
+            cpu_seconds += children_cpu_time() - start_children_cpu
+            process_cpu_seconds = time.process_time() - start_process_cpu
+            stack.pop()
+
+            record = {
+                "stage": name,
+                "parent": parent.name if parent is not None else None,
+                "start": start_timestamp,
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": cpu_seconds,
+                "process_cpu_seconds": process_cpu_seconds,
+                **stage.counts,
+            }
+            for key, value in stage.counts.items():
+                record[f"{key}_per_second"] = value / max(wall_seconds, 1e-9)
+
+            if self.memory == "tracemalloc":
+                traced_peak = max(
+                    getattr(stage, "traced_peak", 0), tracemalloc.get_traced_memory()[1]
+                )
+                record["peak_traced_bytes"] = traced_peak
+                if parent is not None:
+                    parent.traced_peak = max(
+                        getattr(parent, "traced_peak", 0), traced_peak
+                    )
+            elif self.resets_peak_rss:
+                record.update(self.end_peak_rss(stage))
+            elif self.memory == "rss":
+                rss = read_rss()
+                if "peak_rss_bytes" in rss:
+                    rss["process_peak_rss_bytes"] = rss.pop("peak_rss_bytes")
+                record.update(rss)
+
+            self.write(record)
+
+    def add(self, **counts):
+        """
+        Adds to the amounts processed by the innermost stage running in this
+        thread, for code that has no reference to its stage. Does nothing if no
+        stage is running.
+        """
+        stack = getattr(self.local, "stack", None)
+        if stack:
+            stack[-1].add(**counts)
+
+    def start_peak_rss(self, stage):
+        """
+        Resets the peak resident memory of the process at the start of a stage,
+        after keeping the peak so far of each stage that is still running.
+        """
+        with self.lock:
+            peak = read_rss().get("peak_rss_bytes", 0)
+            for other in self.active_stages:
+                other.rss_peak = max(other.rss_peak, peak)
+            reset_peak_rss()
+            stage.rss_peak = 0
+            self.active_stages.add(stage)
+
+    def end_peak_rss(self, stage):
+        """
+        Returns the current and peak resident memory of a stage that has ended.
+        """
+        with self.lock:
+            self.active_stages.discard(stage)
+            rss = read_rss()
+            rss["peak_rss_bytes"] = max(stage.rss_peak, rss.get("peak_rss_bytes", 0))
+            return rss
+
+    def write(self, record):
+        """
+        Appends a record to the metrics file as a JSON line.
+        """
+        with self.lock, open(self.output_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def input_counts(input_file, text=None):
+    """
+    Returns the input size of a task for its stage record: the bytes it reads from
+    its input file, or the characters of its input if it is already in memory.
+    """
+    if text is not None:
+        return {"chars": len(text)}
+    return {"bytes_read": os.path.getsize(input_file)}
+
+
+def children_cpu_time():
+    """
+    Returns the CPU time in seconds of the child processes that have exited and
+    been waited for.
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory of the process to its current value, which
+    Linux supports through /proc/self/clear_refs.
+
+    Returns:
+        bool: Whether the peak was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def read_rss():
+    """
+    Returns the current and peak resident memory of the process in bytes, where the
+    platform reports them. The peak is since the process started, or since it was
+    last reset with `reset_peak_rss`.
+    """
+    rss = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss["rss_bytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    rss["peak_rss_bytes"] = int(line.split()[1]) * 1024
+        return rss
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return rss
+
+    scale = 1 if sys.platform == "darwin" else 1024
+    rss["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return rss
+
+
+@contextmanager
+def profile_task(name, output_dir, profiler="cprofile"):
+    """
+    Profiles the code run inside the context and saves the profile.
+
+    Args:
+        name (str): The task name, used for the profile's file name.
+        output_dir (str): Directory to save the profile to.
+        profiler (str): 'cprofile' to save a pstats file and print the 20 functions
+            with the highest cumulative time, or 'pyinstrument' to save an HTML
+            report, which requires `pyinstrument`.
+    """
+    if profiler not in ("cprofile", "pyinstrument"):
+        raise ValueError("Invalid profiler. Choose 'cprofile' or 'pyinstrument'.")
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError(
+                "The 'pyinstrument' profiler requires pyinstrument. "
+                "Install it with: pip install pyinstrument"
+            ) from e
+
+        instrument = Profiler()
+        instrument.start()
+        try:
+            yield
+        finally:
+            instrument.stop()
+            output_file = os.path.join(output_dir, f"{name}.html")
+            with open(output_file, "w", encoding="utf-8") as f:
+                f.write(instrument.output_html())
+            print(f"Profile of '{name}' saved to {output_file}")
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        output_file = os.path.join(output_dir, f"{name}.prof")
+        profile.dump_stats(output_file)
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(20)
+        print(summary.getvalue())
+        print(f"Profile of '{name}' saved to {output_file}")
+
+
+# The recorder shared by all tasks in this process
+metrics = MetricsRecorder()
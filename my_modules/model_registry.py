@@ -0,0 +1,178 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ModelRegistry:
+    """
+    A process-wide store of loaded models, tokenizers and spaCy pipelines, so that
+    running a task again in the same session reuses them instead of loading them
+    from disk.
+
+    Models are loaded on first use. When their estimated memory use grows beyond
+    `max_bytes`, the least recently used models are dropped. The hits, misses and
+    load times of each model are recorded for `print_report`.
+
+    Models are loaded outside the registry's lock, so that tasks running at the
+    same time can load or reuse other models meanwhile. Tasks that ask for a model
+    that is still loading wait for that load instead of starting another one.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024 * 1024):
+        """
+        Initialize the ModelRegistry instance.
+
+        Args:
+            max_bytes (int): Maximum estimated memory use of the loaded models in
+                bytes. The most recently used model is always kept.
+        """
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.stats = {}
+        self.loading = {}
+        self.lock = threading.RLock()
+
+    def get(self, key, loader):
+        """
+        Returns the model stored under a key, loading it first if needed.
+
+        Args:
+            key (tuple): Identifies the model, e.g. its kind, name and any options
+                that change how it is loaded.
+            loader (callable): Loads the model when it is not stored yet.
+
+        Returns:
+            The model.
+        """
+        with self.lock:
+            stats = self.stats.setdefault(
+                key, {"hits": 0, "misses": 0, "load_seconds": 0.0, "bytes": 0}
+            )
+            if key in self.models:
+                self.models.move_to_end(key)
+                stats["hits"] += 1
+                print(f"Reusing loaded model: {format_key(key)}")
+                return self.models[key][0]
+
+            # Wait for the load another task has started, if any
+            pending = self.loading.get(key)
+            if pending is not None:
+                stats["hits"] += 1
+            else:
+                self.loading[key] = Future()
+
+        if pending is not None:
+            print(f"Waiting for model to load: {format_key(key)}")
+            return pending.result()
+
+        start_time = time.perf_counter()
+        try:
+            model = loader()
+        except BaseException as e:
+            with self.lock:
+                self.loading.pop(key).set_exception(e)
+            raise
+        elapsed = time.perf_counter() - start_time
+        size = estimate_model_size(model)
+
+        with self.lock:
+            stats["misses"] += 1
+            stats["load_seconds"] += elapsed
+            stats["bytes"] = size
+            print(f"Loaded model {format_key(key)} in {elapsed:.2f}s")
+
+            self.models[key] = (model, size)
+            self.evict()
+            self.loading.pop(key).set_result(model)
+        return model
+
+    def evict(self):
+        """
+        Drops the least recently used models until the loaded models fit in
+        `max_bytes`, keeping at least the most recently used one.
+        """
+        total_size = sum(size for _, size in self.models.values())
+        while total_size > self.max_bytes and len(self.models) > 1:
+            key, (_, size) = self.models.popitem(last=False)
+            total_size -= size
+            print(f"Unloaded model: {format_key(key)}")
+
+    def clear(self):
+        """
+        Drops all loaded models.
+        """
+        with self.lock:
+            self.models.clear()
+
+    def report(self):
+        """
+        Returns the hits, misses, total load time and estimated size of each model
+        requested so far.
+
+        Returns:
+            list: A dict for each model.
+        """
+        with self.lock:
+            return [
+                {"model": format_key(key), "loaded": key in self.models, **stats}
+                for key, stats in self.stats.items()
+            ]
+
+    def print_report(self):
+        """
+        Prints the hits, misses and load times of each model requested so far.
+        """
+        rows = self.report()
+        if not rows:
+            return
+
+        print("\nModel registry report")
+        print(f"{'Hits':>6} {'Misses':>6} {'Load (s)':>9} {'Size (MB)':>10}  Model")
+        for row in rows:
+            print(
+                f"{row['hits']:>6} {row['misses']:>6} {row['load_seconds']:>9.2f} "
+                f"{row['bytes'] / (1024 * 1024):>10.1f}  {row['model']}"
+            )
+
+
+def format_key(key):
+    """
+    Formats a registry key for display.
+    """
+    return "/".join(str(part) for part in key if part is not None)
+
+
+def estimate_model_size(model):
+    """
+    Estimates the memory used by a model from its weights: the parameters and
+    buffers of a PyTorch module, or the vectors and layer parameters of a spaCy
+    pipeline. Other objects, such as tokenizers, count as their shallow size.
+
+    Args:
+        model: The loaded model.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    if hasattr(model, "pipeline") and hasattr(model, "vocab"):
+        size = model.vocab.vectors.data.nbytes
+        for _, pipe in model.pipeline:
+            if not hasattr(pipe, "model"):
+                continue
+            for node in pipe.model.walk():
+                for name in node.param_names:
+                    if node.has_param(name):
+                        size += node.get_param(name).nbytes
+        return size
+
+    return sys.getsizeof(model)
+
+
+# The registry shared by all tasks in this process
+model_registry = ModelRegistry()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+
+class NERChunkCache:
+    """
+    A class to store the entities found in each text chunk in a SQLite database,
+    keyed by a hash of the chunk's text and the model settings, so that reruns only
+    process new or changed chunks.
+
+    When the stored entities grow beyond `max_bytes`, the least recently used
+    chunks are removed.
+    """
+
+    # Number of keys per query, below SQLite's limit on query parameters
+    query_size = 500
+
+    def __init__(self, db_path, max_bytes=1024 * 1024 * 1024):
+        """
+        Initialize the NERChunkCache instance.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+            max_bytes (int): Maximum total size of the stored entities in bytes.
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+
+        with sqlite3.connect(self.db_path) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "key TEXT PRIMARY KEY, entities TEXT, size INTEGER, last_used REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS chunks_last_used ON chunks (last_used)"
+            )
+
+    @staticmethod
+    def make_key(settings, skip, text):
+        """
+        Builds the key of a chunk.
+
+        Args:
+            settings (list): The model settings that affect the entities found.
+            skip (int): The number of leading characters whose entities are skipped.
+            text (str): The chunk's text.
+
+        Returns:
+            str: The chunk key.
+        """
+        digest = hashlib.sha256(json.dumps([settings, skip]).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """
+        Looks up the entities of many chunks and marks them as recently used.
+
+        Args:
+            keys (list): The chunk keys.
+
+        Returns:
+            dict: The entities of each cached chunk, by key.
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with sqlite3.connect(self.db_path) as connection:
+            for start in range(0, len(unique_keys), self.query_size):
+                batch = unique_keys[start : start + self.query_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    f"SELECT key, entities FROM chunks WHERE key IN ({placeholders})",
+                    batch,
+                )
+                found.update((key, json.loads(entities)) for key, entities in rows)
+                connection.execute(
+                    f"UPDATE chunks SET last_used = ? WHERE key IN ({placeholders})",
+                    [time.time(), *batch],
+                )
+        return found
+
+    def put_many(self, items):
+        """
+        Stores the entities of many chunks and evicts the least recently used chunks
+        if the cache is over its size limit.
+
+        Args:
+            items (iterable): (key, entities) tuples, where entities is
+                JSON-serializable.
+        """
+        now = time.time()
+        rows = []
+        for key, entities in items:
+            serialized = json.dumps(entities)
+            rows.append((key, serialized, len(serialized), now))
+
+        with sqlite3.connect(self.db_path) as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunks (key, entities, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used chunks until the stored entities fit in
+        `max_bytes`.
+        """
+        with sqlite3.connect(self.db_path) as connection:
+            (total_size,) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM chunks"
+            ).fetchone()
+            if total_size <= self.max_bytes:
+                return
+
+            removed_keys = []
+            for key, size in connection.execute(
+                "SELECT key, size FROM chunks ORDER BY last_used"
+            ):
+                if total_size <= self.max_bytes:
+                    break
+                removed_keys.append((key,))
+                total_size -= size
+            connection.executemany("DELETE FROM chunks WHERE key = ?", removed_keys)
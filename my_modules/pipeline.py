@@ -0,0 +1,184 @@
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from my_modules.metrics import metrics
+
+
+class TaskPipeline:
+    """
+    A class to run tasks without the interactive menu, in the order given by their
+    dependencies, with independent tasks running at the same time.
+
+    Each task receives the results of the tasks it requires, so that artifacts
+    such as the extracted text are passed between tasks in memory.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Initialize the TaskPipeline instance.
+
+        Args:
+            workers (int, optional): Maximum number of tasks to run at the same
+                time. Defaults to the number of tasks being run.
+        """
+        self.workers = workers
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def add_task(self, name, run, requires=(), after=()):
+        """
+        Registers a task.
+
+        Args:
+            name (str): The task name.
+            run (callable): Runs the task. It is called with a dict of the results
+                of the required tasks, by name, and returns the task's result.
+            requires (tuple): Tasks that are run first, even if they were not
+                selected, and whose results are passed to `run`.
+            after (tuple): Tasks that are run first only if they were also
+                selected.
+        """
+        self.tasks[name] = {
+            "run": run,
+            "requires": tuple(requires),
+            "after": tuple(after),
+        }
+
+    def resolve(self, names):
+        """
+        Finds the tasks to run for the selected tasks, and the tasks each of them
+        waits for.
+
+        Args:
+            names (list): The selected task names.
+
+        Returns:
+            dict: The task names to run, each with the set of task names it waits
+                for.
+
+        Raises:
+            ValueError: If a task is unknown or the dependencies form a cycle.
+        """
+        selected = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in self.tasks:
+                raise ValueError(
+                    f"Unknown task '{name}'. Choose from: {', '.join(self.tasks)}."
+                )
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.tasks[name]["requires"])
+
+        graph = {
+            name: set(self.tasks[name]["requires"])
+            | (set(self.tasks[name]["after"]) & selected)
+            for name in selected
+        }
+
+        # Check for cycles by removing the tasks that wait for nothing, in rounds
+        remaining = {name: set(waits_for) for name, waits_for in graph.items()}
+        while remaining:
+            ready = [name for name, waits_for in remaining.items() if not waits_for]
+            if not ready:
+                raise ValueError(
+                    "The task dependencies form a cycle: " + ", ".join(remaining)
+                )
+            for name in ready:
+                del remaining[name]
+            for waits_for in remaining.values():
+                waits_for.difference_update(ready)
+
+        return graph
+
+    def run(self, names):
+        """
+        Runs the selected tasks and the tasks they require. A task starts as soon
+        as the tasks it waits for have finished. If a task fails, the tasks that
+        depend on it are skipped.
+
+        Args:
+            names (list): The selected task names.
+
+        Returns:
+            dict: The status ('done', 'failed' or 'skipped') and the seconds taken
+                by each task.
+        """
+        graph = self.resolve(names)
+        results = {}
+        report = {}
+        running = {}
+
+        def start_ready_tasks(executor):
+            # Skipping a task can make the tasks waiting for it skippable, so
+            # repeat until nothing changes
+            changed = True
+            while changed:
+                changed = False
+                for name, waits_for in graph.items():
+                    if name in report or name in running.values():
+                        continue
+                    if not all(other in report for other in waits_for):
+                        continue
+
+                    if all(report[other]["status"] == "done" for other in waits_for):
+                        required = {
+                            other: results[other]
+                            for other in self.tasks[name]["requires"]
+                        }
+                        print(f"[pipeline] Starting '{name}'")
+                        future = executor.submit(self.run_task, name, required)
+                        running[future] = name
+                    else:
+                        report[name] = {"status": "skipped", "seconds": 0.0}
+                        print(
+                            f"[pipeline] Skipping '{name}', as a task it needs failed"
+                        )
+                        changed = True
+
+        with ThreadPoolExecutor(max_workers=self.workers or len(graph)) as executor:
+            while len(report) < len(graph):
+                start_ready_tasks(executor)
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    status, result, seconds = future.result()
+                    report[name] = {"status": status, "seconds": seconds}
+                    if status == "done":
+                        results[name] = result
+                    print(f"[pipeline] '{name}' {status} in {seconds:.2f}s")
+
+        print("\nPipeline report")
+        for name, row in report.items():
+            print(f"{row['status']:>8} {row['seconds']:>10.2f}s  {name}")
+
+        return report
+
+    def run_task(self, name, required):
+        """
+        Runs a task, catching any error so that the other tasks can continue. The
+        task is measured, and profiled if selected, by the metrics recorder.
+
+        Args:
+            name (str): The task name.
+            required (dict): The results of the required tasks, by name.
+
+        Returns:
+            tuple: The status, the task's result and the seconds taken.
+        """
+        start_time = time.perf_counter()
+        try:
+            with metrics.task(name):
+                result = self.tasks[name]["run"](required)
+        except Exception:
+            with self.lock:
+                print(f"[pipeline] Error in '{name}':")
+                traceback.print_exc()
+            return "failed", None, time.perf_counter() - start_time
+        return "done", result, time.perf_counter() - start_time
@@ -1,14 +1,30 @@
+import json
 import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 
+from my_modules.helper import hash_file, process_pool_context
+from my_modules.metrics import metrics
+
 
 class CSVTextExtractor:
     """
     A class to extract text from CSV files in a directory and write it to an output file.
     """
 
-    def __init__(self, input_file, output_file, text_cols=None):
+    def __init__(
+        self,
+        input_file,
+        output_file,
+        text_cols=None,
+        chunk_size=None,
+        workers=None,
+        manifest_file=None,
+    ):
         """
         Initialize the CSVTextExtractor instance.
 
@@ -16,10 +32,24 @@ class CSVTextExtractor:
         - input_file: Directory containing CSV files.
         - output_file: Path for the extracted text to be written.
         - text_cols: A list of columns to extract text from. If None, all columns will be extracted.
+        - chunk_size: Number of rows to read at a time. If None, each CSV file is read
+          in one go; otherwise the files are streamed in chunks of this many rows.
+          Streaming writes the values as they appear in the CSV files, while reading
+          in one go writes numeric-looking values as pandas parses them (see
+          `stream_csv_file`).
+        - workers: Number of worker processes. If None or 1, files are extracted one
+          after another; otherwise they are extracted concurrently into per-file
+          shards which are then merged in sorted file order.
+        - manifest_file: Path of a manifest recording each source file and its byte
+          range in the output. If given, reruns only extract new or changed files and
+          reuse the text of the others from the previous output.
         """
         self.input_file = input_file
         self.output_file = output_file
         self.text_cols = text_cols
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.manifest_file = manifest_file
 
     def extract_text_from_csv_files(self):
         """
@@ -36,42 +66,454 @@ class CSVTextExtractor:
             os.makedirs(output_dir)
             print(f"Created the output directory: {output_dir}")
 
-        # Open the output file for writing
-        with open(self.output_file, "w") as f:
-            for file in os.listdir(self.input_file):
-                if file.endswith(".csv"):
-                    file_path = os.path.join(self.input_file, file)
-
-                    try:
-                        # Read the CSV file
-                        df = pd.read_csv(file_path)
-
-                        # If text_cols is provided, check which of the specified columns exist
-                        if self.text_cols:
-                            available_cols = [
-                                col for col in self.text_cols if col in df.columns
-                            ]
-
-                            if not available_cols:
-                                print(
-                                    f"Warning: None of the specified columns {self.text_cols} were found in {file}. Skipping this file."
-                                )
-                                continue
-                        else:
-                            # If text_cols is None, extract all columns
-                            available_cols = df.columns
-
-                        # Combine the available columns into a single text column
-                        df["combined_text"] = df[available_cols].apply(
-                            lambda row: " ".join(row.dropna().astype(str)), axis=1
-                        )
+        csv_files = self.list_csv_files()
+        input_bytes = sum(
+            os.path.getsize(os.path.join(self.input_file, file)) for file in csv_files
+        )
 
-                        # Write the combined text to the output file
-                        df["combined_text"].dropna().to_csv(
-                            f, header=False, index=False
+        with metrics.stage(
+            "extract_text", bytes_read=input_bytes, files=len(csv_files)
+        ) as stage:
+            if self.manifest_file:
+                self.extract_incrementally(csv_files)
+            elif self.workers and self.workers > 1:
+                self.extract_in_parallel(csv_files)
+            else:
+                # Open the output file for writing
+                with open(self.output_file, "w") as f:
+                    for file in csv_files:
+                        _, _, rows = self.extract_file(
+                            os.path.join(self.input_file, file), f
                         )
-
-                    except Exception as e:
-                        print(f"Error processing {file}: {e}")
+                        stage.add(rows=rows)
+            stage.add(bytes_written=os.path.getsize(self.output_file))
 
         print(f"Text extracted successfully to {self.output_file}")
+
+    def list_csv_files(self):
+        """
+        List the CSV files in the input directory in sorted order, so that the
+        output does not depend on the order the file system returns them in.
+
+        Returns:
+            list: The CSV file names.
+        """
+        return sorted(
+            file for file in os.listdir(self.input_file) if file.endswith(".csv")
+        )
+
+    def extract_file(self, file_path, f):
+        """
+        Extract the text of a single CSV file and write it to an open output file.
+
+        If the file fails partway through, the text already written for it is
+        removed again, so that a failed file adds nothing to the output in any mode.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            f (file): The output file to write to.
+
+        Returns:
+            tuple: The time taken in seconds, whether the file was extracted without
+                errors, and the number of rows extracted.
+        """
+        start_time = time.perf_counter()
+        start_position = f.tell()
+        try:
+            if self.chunk_size:
+                rows = self.stream_csv_file(file_path, f)
+            else:
+                rows = self.extract_csv_file(file_path, f)
+        except Exception as e:
+            print(f"Error processing {os.path.basename(file_path)}: {e}")
+            f.seek(start_position)
+            f.truncate()
+            return time.perf_counter() - start_time, False, 0
+        return time.perf_counter() - start_time, True, rows
+
+    def extract_to_shards(self, csv_files, shard_dir):
+        """
+        Extract each CSV file into its own shard file, concurrently if `workers` is
+        greater than 1, and report the time taken for each file.
+
+        Args:
+            csv_files (list): The CSV file names.
+            shard_dir (str): Directory to write the shard files to.
+
+        Returns:
+            tuple: The shard paths, in the same order as `csv_files`, and the set of
+                file names that failed to extract.
+        """
+        shard_paths = [
+            os.path.join(shard_dir, f"{index:06d}.txt")
+            for index in range(len(csv_files))
+        ]
+        file_paths = [os.path.join(self.input_file, file) for file in csv_files]
+
+        if self.workers and self.workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=process_pool_context()
+            ) as executor:
+                futures = [
+                    executor.submit(extract_shard, self, file_path, shard_path)
+                    for file_path, shard_path in zip(file_paths, shard_paths)
+                ]
+                results = [future.result() for future in futures]
+        else:
+            results = [
+                extract_shard(self, file_path, shard_path)
+                for file_path, shard_path in zip(file_paths, shard_paths)
+            ]
+
+        failed_files = set()
+        for file, (elapsed, succeeded, rows) in zip(csv_files, results):
+            metrics.add(rows=rows)
+            if succeeded:
+                print(f"Extracted {file} in {elapsed:.2f}s")
+            else:
+                print(f"Failed to extract {file} after {elapsed:.2f}s")
+                failed_files.add(file)
+
+        return shard_paths, failed_files
+
+    def extract_in_parallel(self, csv_files):
+        """
+        Extract the CSV files concurrently into per-file shards, then merge the shards
+        into the output file in sorted file order, leaving out the shards of files
+        that failed. The output is byte-identical to a serial run.
+
+        Args:
+            csv_files (list): The sorted CSV file names.
+        """
+        output_dir = os.path.dirname(self.output_file) or "."
+        with tempfile.TemporaryDirectory(dir=output_dir) as shard_dir:
+            shard_paths, failed_files = self.extract_to_shards(csv_files, shard_dir)
+
+            # Merge the shards in sorted file order
+            with open(self.output_file, "wb") as f:
+                for file, shard_path in zip(csv_files, shard_paths):
+                    if file in failed_files:
+                        continue
+                    with open(shard_path, "rb") as shard:
+                        shutil.copyfileobj(shard, f)
+
+    def extract_incrementally(self, csv_files):
+        """
+        Extract only the CSV files that are new or changed since the last run, and
+        reuse the text of the unchanged files from the previous output.
+
+        A file is unchanged if its size and modification time match the manifest, or
+        failing that, if its content hash does. When the unchanged files are exactly
+        the files of the previous run, the new text is appended to the output;
+        otherwise the output is rebuilt by splicing the reused byte ranges together
+        with the newly extracted text. The manifest is then rewritten.
+
+        Files that fail to extract are left out of both the output and the manifest,
+        so that the next run extracts them again.
+
+        Args:
+            csv_files (list): The sorted CSV file names.
+        """
+        previous = self.load_manifest()
+        previous_files = {entry["file"]: entry for entry in previous["files"]}
+
+        entries = []
+        changed_files = []
+        for file in csv_files:
+            file_path = os.path.join(self.input_file, file)
+            stat = os.stat(file_path)
+            entry = {"file": file, "size": stat.st_size, "mtime": stat.st_mtime}
+
+            old_entry = previous_files.get(file)
+            if old_entry and old_entry["size"] == entry["size"]:
+                if old_entry["mtime"] == entry["mtime"]:
+                    entry["sha256"] = old_entry["sha256"]
+                else:
+                    entry["sha256"] = hash_file(file_path)
+                if entry["sha256"] == old_entry["sha256"]:
+                    entry["reuse"] = (old_entry["start"], old_entry["end"])
+            if "sha256" not in entry:
+                entry["sha256"] = hash_file(file_path)
+            if "reuse" not in entry:
+                changed_files.append(file)
+            entries.append(entry)
+
+        reused = [entry for entry in entries if "reuse" in entry]
+        print(
+            f"Reusing {len(reused)} unchanged file(s), "
+            f"extracting {len(changed_files)} new or changed file(s)"
+        )
+
+        output_dir = os.path.dirname(self.output_file) or "."
+        with tempfile.TemporaryDirectory(dir=output_dir) as shard_dir:
+            shard_paths, failed_files = self.extract_to_shards(changed_files, shard_dir)
+            shard_paths = dict(zip(changed_files, shard_paths))
+
+            # Leave the failed files out, so they are retried on the next run
+            if failed_files:
+                print(
+                    f"{len(failed_files)} file(s) failed and will be extracted "
+                    "again on the next run"
+                )
+                entries = [
+                    entry for entry in entries if entry["file"] not in failed_files
+                ]
+
+            # The output can be appended to if the reused files are the files of
+            # the previous run and come first in sorted order
+            can_append = bool(reused) and [
+                entry["file"] for entry in entries[: len(reused)]
+            ] == [entry["file"] for entry in previous["files"]]
+
+            if can_append:
+                with open(self.output_file, "ab") as f:
+                    self.write_entries(entries, shard_paths, None, f)
+            else:
+                temp_output = os.path.join(shard_dir, "output.txt")
+                with open(temp_output, "wb") as f:
+                    if reused:
+                        with open(self.output_file, "rb") as old_output:
+                            self.write_entries(entries, shard_paths, old_output, f)
+                    else:
+                        self.write_entries(entries, shard_paths, None, f)
+                os.replace(temp_output, self.output_file)
+
+        self.save_manifest(entries)
+
+    def write_entries(self, entries, shard_paths, old_output, f):
+        """
+        Write the text of each manifest entry to the output, either copied from its
+        byte range in the previous output or from its freshly extracted shard, and
+        record the byte range it now occupies.
+
+        Args:
+            entries (list): The manifest entries to write, in order.
+            shard_paths (dict): The shard path of each newly extracted file.
+            old_output (file): The previous output opened in binary mode, or None.
+            f (file): The output file opened in binary mode.
+        """
+        position = f.tell()
+        for entry in entries:
+            reuse = entry.pop("reuse", None)
+            if reuse and old_output is not None:
+                old_output.seek(reuse[0])
+                copy_bytes(old_output, f, reuse[1] - reuse[0])
+            elif reuse:
+                # Appending to the previous output, so the text is already in place
+                entry["start"], entry["end"] = reuse
+                continue
+            else:
+                with open(shard_paths[entry["file"]], "rb") as shard:
+                    shutil.copyfileobj(shard, f)
+            entry["start"] = position
+            position = f.tell()
+            entry["end"] = position
+
+    def load_manifest(self):
+        """
+        Load the manifest of the previous run.
+
+        The manifest is ignored if it is missing, was written with different
+        settings, or no longer matches the size of the output file.
+
+        Returns:
+            dict: The manifest, with an empty file list if it cannot be used.
+        """
+        empty_manifest = {"files": [], "output_size": 0}
+        if not os.path.isfile(self.manifest_file) or not os.path.isfile(
+            self.output_file
+        ):
+            return empty_manifest
+
+        try:
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read the manifest '{self.manifest_file}': {e}")
+            return empty_manifest
+
+        if manifest.get("settings") != self.manifest_settings() or manifest.get(
+            "output_size"
+        ) != os.path.getsize(self.output_file):
+            print("The manifest is out of date. Extracting all files.")
+            return empty_manifest
+
+        return manifest
+
+    def manifest_settings(self):
+        """
+        The settings that change the extracted text, so that text extracted with
+        different settings is never mixed in one output.
+
+        Returns:
+            dict: The text columns and the read mode.
+        """
+        return {
+            "text_cols": self.text_cols,
+            "mode": "stream" if self.chunk_size else "whole",
+        }
+
+    def save_manifest(self, entries):
+        """
+        Write the manifest for the current output.
+
+        Args:
+            entries (list): The manifest entries, in output order.
+        """
+        manifest = {
+            "settings": self.manifest_settings(),
+            "output_size": os.path.getsize(self.output_file),
+            "files": entries,
+        }
+        with open(self.manifest_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def get_available_columns(self, columns, file_path):
+        """
+        Select the text columns to extract from the columns present in a CSV file.
+
+        Args:
+            columns (Index): The columns found in the CSV file.
+            file_path (str): Path to the CSV file, used in the warning message.
+
+        Returns:
+            list: The columns to extract, or None if none of `text_cols` is present.
+        """
+        # If text_cols is None, extract all columns
+        if not self.text_cols:
+            return list(columns)
+
+        # If text_cols is provided, check which of the specified columns exist
+        available_cols = [col for col in self.text_cols if col in columns]
+        if not available_cols:
+            print(
+                f"Warning: None of the specified columns {self.text_cols} were found in {os.path.basename(file_path)}. Skipping this file."
+            )
+            return None
+        return available_cols
+
+    def extract_csv_file(self, file_path, f):
+        """
+        Read a whole CSV file and write its combined text to an open output file.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            f (file): The output file to write to.
+
+        Returns:
+            int: The number of rows extracted.
+        """
+        # Read the CSV file
+        df = pd.read_csv(file_path)
+
+        available_cols = self.get_available_columns(df.columns, file_path)
+        if available_cols is None:
+            return 0
+
+        # Combine the available columns into a single text column
+        df["combined_text"] = df[available_cols].apply(
+            lambda row: " ".join(row.dropna().astype(str)), axis=1
+        )
+
+        # Write the combined text to the output file
+        df["combined_text"].dropna().to_csv(f, header=False, index=False)
+        return len(df)
+
+    def stream_csv_file(self, file_path, f):
+        """
+        Stream a CSV file in chunks of `chunk_size` rows and write its combined text
+        to an open output file.
+
+        Only the text columns are parsed, and they are read as strings so that every
+        chunk is handled the same way. Memory use is bounded by the chunk size rather
+        than by the size of the file.
+
+        Values are written exactly as they appear in the CSV file. This differs from
+        `extract_csv_file` for numeric-looking columns, whose values pandas parses
+        as numbers first: for example, "1" in an integer column with missing values
+        is written as "1.0" by `extract_csv_file` but as "1" here.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            f (file): The output file to write to.
+
+        Returns:
+            int: The number of rows extracted.
+        """
+        # Read only the header to find out which columns are present
+        header = pd.read_csv(file_path, nrows=0).columns
+        available_cols = self.get_available_columns(header, file_path)
+        if available_cols is None:
+            return 0
+
+        reader = pd.read_csv(
+            file_path,
+            usecols=available_cols,
+            dtype=str,
+            chunksize=self.chunk_size,
+        )
+        rows = 0
+        for chunk in reader:
+            combined_text = self.combine_columns(chunk, available_cols)
+            combined_text.to_csv(f, header=False, index=False)
+            rows += len(chunk)
+        return rows
+
+    @staticmethod
+    def combine_columns(df, columns):
+        """
+        Join the non-missing values of the given columns with a single space, using
+        column-wise string operations instead of a Python function per row.
+
+        Rows where every column is missing become an empty string, matching the
+        row-wise `" ".join(row.dropna())` of `extract_csv_file`.
+
+        Args:
+            df (DataFrame): The chunk holding the text columns as strings.
+            columns (list): The columns to combine, in order.
+
+        Returns:
+            Series: The combined text of each row.
+        """
+        combined = df[columns[0]]
+        for col in columns[1:]:
+            right = df[col]
+            both = combined.notna() & right.notna()
+            joined = combined.str.cat(right, sep=" ")
+            combined = joined.where(both, combined.fillna(right))
+        return combined.fillna("")
+
+
+def extract_shard(extractor, file_path, shard_path):
+    """
+    Extract a single CSV file into its own shard file. Runs in a worker process.
+
+    Args:
+        extractor (CSVTextExtractor): The extractor holding the settings.
+        file_path (str): Path to the CSV file.
+        shard_path (str): Path of the shard file to write.
+
+    Returns:
+        tuple: The time taken in seconds, whether the file was extracted without
+            errors, and the number of rows extracted.
+    """
+    with open(shard_path, "w") as f:
+        return extractor.extract_file(file_path, f)
+
+
+def copy_bytes(source, destination, length, block_size=1024 * 1024):
+    """
+    Copy `length` bytes from the current position of one binary file to another.
+
+    Args:
+        source (file): The file to read from.
+        destination (file): The file to write to.
+        length (int): Number of bytes to copy.
+        block_size (int): Number of bytes to copy at a time.
+    """
+    while length > 0:
+        block = source.read(min(block_size, length))
+        if not block:
+            break
+        destination.write(block)
+        length -= len(block)
@@ -1,20 +1,32 @@
 import spacy
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 
+from my_modules.model_registry import model_registry
+
 
 class TextProcessor:
     def __init__(self):
         # Load SpaCy models
-        self.nlp_sci_sm = spacy.load("en_core_sci_sm")
+        self.nlp_sci_sm = model_registry.get(
+            ("spacy", "en_core_sci_sm"), lambda: spacy.load("en_core_sci_sm")
+        )
         print("Loaded SpaCy model: en_core_sci_sm")
 
-        self.nlp_ner_bc5cdr_md = spacy.load("en_ner_bc5cdr_md")
+        self.nlp_ner_bc5cdr_md = model_registry.get(
+            ("spacy", "en_ner_bc5cdr_md"), lambda: spacy.load("en_ner_bc5cdr_md")
+        )
         print("Loaded SpaCy model: en_ner_bc5cdr_md")
 
         # Load BioBERT model and tokenizer from Hugging Face
-        self.tokenizer = AutoTokenizer.from_pretrained("dmis-lab/biobert-v1.1")
-        self.model = AutoModelForTokenClassification.from_pretrained(
-            "dmis-lab/biobert-v1.1"
+        self.tokenizer = model_registry.get(
+            ("tokenizer", "dmis-lab/biobert-v1.1"),
+            lambda: AutoTokenizer.from_pretrained("dmis-lab/biobert-v1.1"),
+        )
+        self.model = model_registry.get(
+            ("token-classification", "dmis-lab/biobert-v1.1"),
+            lambda: AutoModelForTokenClassification.from_pretrained(
+                "dmis-lab/biobert-v1.1"
+            ),
         )
         print("Loaded BioBERT model: dmis-lab/biobert-v1.1")
 
@@ -1,7 +1,22 @@
+import codecs
 import csv
+import locale
+import mmap
 import os
 import re
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from my_modules.heavy_hitters import SpaceSaving
+from my_modules.helper import process_pool_context
+from my_modules.metrics import input_counts, metrics
+from my_modules.result_cache import ResultCache, deserialize_counts, serialize_counts
+
+# Regular expression for words, optionally joined by a single hyphen
+WORD_PATTERN = re.compile(r"\b[a-z]+(?:-[a-z]+)?\b")
+
+# The whitespace bytes that memory-mapped files are split after
+WHITESPACE_BYTE_PATTERN = re.compile(rb"[ \t\n]")
 
 
 class TopWordsExtractor:
@@ -9,7 +24,16 @@ class TopWordsExtractor:
     A class to extract the top N most common words from a text file and save them to a CSV file.
     """
 
-    def __init__(self, input_file, output_file, top_n):
+    def __init__(
+        self,
+        input_file,
+        output_file,
+        top_n,
+        block_size=None,
+        workers=None,
+        approx_capacity=None,
+        cache_dir=None,
+    ):
         """
         Initialize the TopWordsExtractor instance.
 
@@ -17,17 +41,38 @@ class TopWordsExtractor:
             input_file (str): Path to the text file to be tokenized.
             output_file (str): Path where the output CSV file will be saved.
             top_n (int): Number of top words to save.
+            block_size (int, optional): If given, the text file is streamed in blocks
+                of this many characters instead of being read in one go.
+            workers (int, optional): If greater than 1, the text file is memory-mapped,
+                split at whitespace into one byte range per worker, and the ranges
+                are counted in parallel processes.
+            approx_capacity (int, optional): If given, the words are counted
+                approximately with a Space-Saving summary that tracks at most this
+                many words, and the maximum overestimation of each count is written
+                next to it. The file is streamed in a single process in this mode.
+            cache_dir (str, optional): If given, the full word counts are cached in
+                this directory, keyed by the content of the text file (and the block
+                size in approximate mode), so that a repeat run or a different
+                `top_n` does not count the words again.
         """
         self.input_file = input_file
         self.output_file = output_file
         self.top_n = top_n
+        self.block_size = block_size
+        self.workers = workers
+        self.approx_capacity = approx_capacity
+        self.cache_dir = cache_dir
 
-    def extract_top_words(self):
+    def extract_top_words(self, text=None):
         """
         Extracts the top N most common words from the input text file and saves them to the output CSV file.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory. The file is then not read again.
         """
         # Check if the input file exists
-        if not os.path.isfile(self.input_file):
+        if text is None and not os.path.isfile(self.input_file):
             print(f"Error: The file '{self.input_file}' does not exist.")
             return
 
@@ -37,21 +82,253 @@ class TopWordsExtractor:
             os.makedirs(output_dir)
             print(f"Created the output directory: {output_dir}")
 
-        # Load and normalize the text
-        with open(self.input_file, "r") as file:
-            text = file.read().lower()
-
         # Count word occurrences
-        words = re.findall(r"\b[a-z]+(?:-[a-z]+)?\b", text)
-        word_counts = Counter(words)
-
-        # Identify the top N most common words
-        top_words = word_counts.most_common(self.top_n)
+        with metrics.stage(
+            "count_words", **input_counts(self.input_file, text)
+        ) as stage:
+            if self.cache_dir:
+                word_counts = self.count_words_cached(text)
+            else:
+                word_counts = self.count_words(text)
+            stage.add(words=count_total(word_counts))
 
         # Write the results to a CSV file
         with open(self.output_file, "w", newline="") as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(["Word", "Count"])  # Header
-            writer.writerows(top_words)
+            if isinstance(word_counts, SpaceSaving):
+                writer.writerow(["Word", "Count", "Error"])  # Header
+                writer.writerows(word_counts.most_common_with_errors(self.top_n))
+            else:
+                writer.writerow(["Word", "Count"])  # Header
+                writer.writerows(word_counts.most_common(self.top_n))
 
         print(f"Top {self.top_n} words have been written to '{self.output_file}'.")
+
+    def count_words(self, text=None):
+        """
+        Counts the occurrences of each word in the input text file.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Returns:
+            Counter or SpaceSaving: The count of each word, or the approximate
+                counts of the most frequent words in approximate mode.
+        """
+        if text is not None:
+            return self.count_words_in_text(text)
+
+        if self.approx_capacity:
+            with open(self.input_file, "r") as file:
+                blocks = iter(lambda: file.read(self.block_size or 1024 * 1024), "")
+                return count_words_in_blocks(blocks, SpaceSaving(self.approx_capacity))
+
+        if self.workers and self.workers > 1:
+            return self.count_words_parallel()
+
+        if self.block_size:
+            with open(self.input_file, "r") as file:
+                blocks = iter(lambda: file.read(self.block_size), "")
+                return count_words_in_blocks(blocks)
+
+        # Load and normalize the text
+        with open(self.input_file, "r") as file:
+            text = file.read().lower()
+
+        return Counter(WORD_PATTERN.findall(text))
+
+    def count_words_cached(self, text=None):
+        """
+        Returns the word counts from the result cache, counting and caching them if
+        they are not cached yet.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Returns:
+            Counter or SpaceSaving: The count of each word.
+        """
+        cache = ResultCache(self.cache_dir)
+        key_parts = [
+            "words",
+            cache.input_hash(self.input_file, text),
+            WORD_PATTERN.pattern,
+            self.approx_capacity,
+        ]
+        if self.approx_capacity:
+            # The Space-Saving counts depend on the blocks the words are added in
+            key_parts.append(self.block_size or 1024 * 1024)
+        key = cache.make_key(*key_parts)
+
+        cached = cache.get(key)
+        if cached is not None:
+            print("Loaded the word counts from the cache.")
+            return deserialize_counts(cached)
+
+        word_counts = self.count_words(text)
+        cache.put(key, serialize_counts(word_counts))
+        return word_counts
+
+    def count_words_in_text(self, text):
+        """
+        Counts the words of text that is already in memory, in blocks of
+        `block_size` characters. The text is always counted in this thread, as
+        sending it to worker processes would copy it, and `workers` is ignored.
+
+        Args:
+            text (str): The text to count the words of.
+
+        Returns:
+            Counter or SpaceSaving: The count of each word.
+        """
+        block_size = self.block_size or 1024 * 1024
+        blocks = (
+            text[start : start + block_size]
+            for start in range(0, len(text), block_size)
+        )
+
+        if self.approx_capacity:
+            return count_words_in_blocks(blocks, SpaceSaving(self.approx_capacity))
+        return count_words_in_blocks(blocks)
+
+    def count_words_parallel(self):
+        """
+        Counts the words of the memory-mapped input file in parallel, one byte range
+        per worker, and merges the partial counts.
+
+        Returns:
+            Counter: The count of each word.
+        """
+        file_size = os.path.getsize(self.input_file)
+        if file_size == 0:
+            return Counter()
+
+        with open(self.input_file, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            boundaries = find_range_boundaries(mapped, file_size, self.workers)
+
+        block_size = self.block_size or 1024 * 1024
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=process_pool_context()
+        ) as executor:
+            futures = [
+                executor.submit(
+                    count_words_in_range, self.input_file, start, end, block_size
+                )
+                for start, end in zip(boundaries, boundaries[1:])
+            ]
+
+            # Merge in range order so ties are ordered as in a serial run
+            word_counts = Counter()
+            for future in futures:
+                word_counts.update(future.result())
+
+        return word_counts
+
+
+def count_total(counts):
+    """
+    Returns the number of items counted by a Counter or a SpaceSaving summary.
+    """
+    if isinstance(counts, SpaceSaving):
+        return counts.total
+    return counts.total()
+
+
+def split_at_last_whitespace(text):
+    """
+    Splits text after its last whitespace character. No word can span whitespace,
+    so the words found in the two parts are the words found in the whole text.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        tuple: The text up to and including the last whitespace, and the rest.
+    """
+    cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t")) + 1
+    return text[:cut], text[cut:]
+
+
+def count_words_in_blocks(blocks, word_counts=None):
+    """
+    Counts the words in a stream of text blocks, carrying any partial word at the
+    end of a block over to the next one. Memory use depends on the block size and
+    the number of distinct words, not on the total length of the text.
+
+    Args:
+        blocks (iterable): The text blocks, in order.
+        word_counts (Counter or SpaceSaving, optional): The counter to update, one
+            block at a time. A new Counter is used if None.
+
+    Returns:
+        Counter or SpaceSaving: The count of each word.
+    """
+    if word_counts is None:
+        word_counts = Counter()
+    carry = ""
+    for block in blocks:
+        text, carry = split_at_last_whitespace(carry + block)
+        word_counts.update(WORD_PATTERN.findall(text.lower()))
+    word_counts.update(WORD_PATTERN.findall(carry.lower()))
+    return word_counts
+
+
+def find_range_boundaries(mapped, file_size, parts):
+    """
+    Splits a memory-mapped file into roughly equal byte ranges that each end just
+    after a whitespace byte, so that no word is split between two ranges.
+
+    Args:
+        mapped (mmap): The memory-mapped file.
+        file_size (int): The size of the file in bytes.
+        parts (int): The number of ranges to split the file into.
+
+    Returns:
+        list: The range boundaries, starting with 0 and ending with `file_size`.
+    """
+    boundaries = [0]
+    for part in range(1, parts):
+        target = max(part * file_size // parts, boundaries[-1])
+        # One search for the nearest whitespace byte, which stops there instead of
+        # scanning to the end of the file for a byte that may never appear
+        match = WHITESPACE_BYTE_PATTERN.search(mapped, target)
+        if match is None:
+            break
+        boundaries.append(match.start() + 1)
+    boundaries.append(file_size)
+
+    # Drop empty ranges
+    return sorted(set(boundaries))
+
+
+def count_words_in_range(file_path, start, end, block_size):
+    """
+    Counts the words in a byte range of a memory-mapped file. Runs in a worker
+    process.
+
+    Args:
+        file_path (str): Path to the text file.
+        start (int): The first byte of the range.
+        end (int): The byte after the end of the range.
+        block_size (int): Number of bytes to decode at a time.
+
+    Returns:
+        Counter: The count of each word in the range.
+    """
+    # Decode with the same encoding `open` uses by default
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))()
+
+    with open(file_path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+
+        def blocks():
+            for position in range(start, end, block_size):
+                yield decoder.decode(mapped[position : min(position + block_size, end)])
+            yield decoder.decode(b"", final=True)
+
+        return count_words_in_blocks(blocks())
@@ -1,14 +1,29 @@
 import csv
+import io
 import os
 import re
 import warnings
 from collections import Counter
+from contextlib import contextmanager
+from itertools import chain
 
+import numpy as np
+import tokenizers
+import transformers
 from tqdm import tqdm
 from transformers import AutoTokenizer
 
+from my_modules.heavy_hitters import SpaceSaving
+from my_modules.metrics import input_counts, metrics
+from my_modules.model_registry import model_registry
+from my_modules.q1_t3_1_most_common_words import count_total
+from my_modules.result_cache import ResultCache, deserialize_counts, serialize_counts
+
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
+# Regular expression for refining tokens
+TOKEN_PATTERN = re.compile(r"\b[a-z]+(?:-[a-z]+)?\b")
+
 
 class UniqueTokenCounter:
     """
@@ -16,7 +31,17 @@ class UniqueTokenCounter:
     and save the top N tokens to a CSV file.
     """
 
-    def __init__(self, input_file, output_file, model_name, top_n):
+    def __init__(
+        self,
+        input_file,
+        output_file,
+        model_name,
+        top_n,
+        approx_capacity=None,
+        engine="chunks",
+        batch_size=1000,
+        cache_dir=None,
+    ):
         """
         Initialize the UniqueTokenCounter instance.
 
@@ -25,19 +50,47 @@ class UniqueTokenCounter:
             output_file (str): Path where the output CSV file will be saved.
             model_name (str): Pretrained model name for the tokenizer.
             top_n (int): Number of top tokens to save.
+            approx_capacity (int, optional): If given, the tokens are counted
+                approximately with a Space-Saving summary that tracks at most this
+                many tokens, and the maximum overestimation of each count is written
+                next to it. Only supported by the 'chunks' engine, as the others
+                count token IDs exactly in memory bounded by the vocabulary size.
+            engine (str): How to tokenize and count the text ('chunks', 'batch' or
+                'bincount').
+            batch_size (int): Number of lines per batch for the 'batch' and
+                'bincount' engines.
+            cache_dir (str, optional): If given, the full token counts are cached in
+                this directory, keyed by the content of the text file, the model name
+                and the tokenizer library versions, so that a repeat run or a
+                different `top_n` does not tokenize the text again.
         """
         self.input_file = input_file
         self.output_file = output_file
         self.model_name = model_name
         self.top_n = top_n
+        self.approx_capacity = approx_capacity
+        self.engine = engine.lower()
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+
+        if self.engine not in ("chunks", "batch", "bincount"):
+            raise ValueError("Invalid engine. Choose 'chunks', 'batch' or 'bincount'.")
+        if self.approx_capacity and self.engine != "chunks":
+            raise ValueError(
+                "Approximate counting is only supported by the 'chunks' engine."
+            )
 
-    def count_unique_tokens(self):
+    def count_unique_tokens(self, text=None):
         """
         Counts unique tokens in the input text file using the specified tokenizer
         and saves the top N tokens to the output CSV file.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory. The file is then not read again.
         """
         # Check if the input file exists
-        if not os.path.isfile(self.input_file):
+        if text is None and not os.path.isfile(self.input_file):
             print(f"Error: The file '{self.input_file}' does not exist.")
             return
 
@@ -47,23 +100,108 @@ class UniqueTokenCounter:
             os.makedirs(output_dir)
             print(f"Created the output directory: {output_dir}")
 
+        with metrics.stage(
+            "count_tokens", **input_counts(self.input_file, text)
+        ) as stage:
+            if self.cache_dir:
+                unique_tokens = self.count_tokens_cached(text)
+            else:
+                unique_tokens = self.count_tokens(text)
+            stage.add(tokens=count_total(unique_tokens))
+
+        # Write the top N most common tokens to the output CSV file
+        with open(self.output_file, "w", newline="", encoding="utf-8") as csvfile:
+            writer = csv.writer(csvfile)
+            if isinstance(unique_tokens, SpaceSaving):
+                writer.writerow(["Token", "Count", "Error"])
+                writer.writerows(unique_tokens.most_common_with_errors(self.top_n))
+            else:
+                writer.writerow(["Token", "Count"])
+                writer.writerows(unique_tokens.most_common(self.top_n))
+
+        print(f"Top {self.top_n} tokens and counts saved to: {self.output_file}")
+
+    def count_tokens(self, text=None):
+        """
+        Counts the refined tokens of the input file with the selected engine.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Returns:
+            Counter or SpaceSaving: The count of each token, or the approximate
+                counts of the most frequent tokens in approximate mode.
+        """
         # Load the tokenizer with the fast implementation
-        tokenizer = AutoTokenizer.from_pretrained(self.model_name, use_fast=True)
+        tokenizer = model_registry.get(
+            ("tokenizer", self.model_name),
+            lambda: AutoTokenizer.from_pretrained(self.model_name, use_fast=True),
+        )
+
+        # Initialize a Counter, or a bounded summary, to keep track of unique tokens
+        if self.approx_capacity:
+            unique_tokens = SpaceSaving(self.approx_capacity)
+        else:
+            unique_tokens = Counter()
+
+        if self.engine == "batch":
+            self.count_tokens_in_batches(tokenizer, unique_tokens, text)
+        elif self.engine == "bincount":
+            self.count_tokens_with_bincount(tokenizer, unique_tokens, text)
+        else:
+            self.count_tokens_in_chunks(tokenizer, unique_tokens, text)
+
+        return unique_tokens
 
-        # Initialize a Counter to keep track of unique tokens
-        unique_tokens = Counter()
+    def count_tokens_cached(self, text=None):
+        """
+        Returns the token counts from the result cache, counting and caching them if
+        they are not cached yet.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Returns:
+            Counter or SpaceSaving: The count of each token.
+        """
+        cache = ResultCache(self.cache_dir)
+        key = cache.make_key(
+            "tokens",
+            cache.input_hash(self.input_file, text),
+            self.model_name,
+            transformers.__version__,
+            tokenizers.__version__,
+            self.engine,
+            self.approx_capacity,
+        )
 
-        # Regular expression for refining tokens
-        token_pattern = re.compile(r"\b[a-z]+(?:-[a-z]+)?\b")
+        cached = cache.get(key)
+        if cached is not None:
+            print("Loaded the token counts from the cache.")
+            return deserialize_counts(cached)
 
-        # Determine the total size for progress bar
-        total_size = os.path.getsize(self.input_file)
+        unique_tokens = self.count_tokens(text)
+        cache.put(key, serialize_counts(unique_tokens))
+        return unique_tokens
 
+    def count_tokens_in_chunks(self, tokenizer, unique_tokens, text=None):
+        """
+        Tokenizes the input file in 1 MB chunks and refines each token with the
+        regular expression.
+
+        Args:
+            tokenizer (PreTrainedTokenizerFast): The tokenizer to use.
+            unique_tokens (Counter or SpaceSaving): The counter to update.
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+        """
         # Process the text file in chunks to avoid loading the entire file into memory
         chunk_size = 1024 * 1024  # 1 MB chunks
 
         # Use a single with statement with multiple contexts
-        with open(self.input_file, "r", encoding="utf-8") as f, tqdm(
+        with self.open_text(text) as (f, total_size), tqdm(
             total=total_size, unit="B", unit_scale=True, desc="Processing File"
         ) as pbar:
             while True:
@@ -77,20 +215,162 @@ class UniqueTokenCounter:
                 # Refine tokens using the regular expression
                 refined_tokens = []
                 for token in tokens:
-                    refined_tokens.extend(re.findall(token_pattern, token.lower()))
+                    refined_tokens.extend(re.findall(TOKEN_PATTERN, token.lower()))
 
                 # Update the counter with the refined tokens
                 unique_tokens.update(refined_tokens)
 
                 pbar.update(len(text_chunk.encode("utf-8")))
 
-        # Get the top N most common tokens
-        top_tokens = unique_tokens.most_common(self.top_n)
+    def count_tokens_in_batches(self, tokenizer, unique_tokens, text=None):
+        """
+        Tokenizes the input file in batches of whole lines with the batch encoding
+        API of the fast tokenizer, and counts token IDs. Each distinct token is
+        refined with the regular expression only once, at the end.
 
-        # Write the results to the output CSV file
-        with open(self.output_file, "w", newline="", encoding="utf-8") as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["Token", "Count"])
-            writer.writerows(top_tokens)
+        Lines always end on whitespace, which the tokenizer splits on, so the counts
+        do not depend on where the batches start and end.
 
-        print(f"Top {self.top_n} tokens and counts saved to: {self.output_file}")
+        Args:
+            tokenizer (PreTrainedTokenizerFast): The tokenizer to use.
+            unique_tokens (Counter): The counter to update.
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+        """
+        token_id_counts = Counter()
+        for batch in self.iter_line_batches(text):
+            encodings = tokenizer(
+                batch,
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )
+            for token_ids in encodings["input_ids"]:
+                token_id_counts.update(token_ids)
+
+        unique_tokens.update(refine_token_counts(tokenizer, token_id_counts))
+
+    def count_tokens_with_bincount(self, tokenizer, unique_tokens, text=None):
+        """
+        Tokenizes the input file in batches of whole lines like
+        `count_tokens_in_batches`, but accumulates the token IDs of each batch into
+        a vocabulary-sized histogram with `np.bincount`. Memory use is fixed by the
+        vocabulary size, and the IDs are only mapped back to tokens and refined at
+        the end.
+
+        Args:
+            tokenizer (PreTrainedTokenizerFast): The tokenizer to use.
+            unique_tokens (Counter): The counter to update.
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+        """
+        histogram = np.zeros(len(tokenizer), dtype=np.int64)
+        for batch in self.iter_line_batches(text):
+            add_token_id_counts(tokenizer, batch, histogram)
+
+        unique_tokens.update(refine_token_histogram(tokenizer, histogram))
+
+    def iter_line_batches(self, text=None):
+        """
+        Reads the input file in batches of `batch_size` lines, showing the progress.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Yields:
+            list: The lines of the next batch.
+        """
+        with self.open_text(text) as (f, total_size), tqdm(
+            total=total_size, unit="B", unit_scale=True, desc="Processing File"
+        ) as pbar:
+            batch = []
+            for line in f:
+                batch.append(line)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    pbar.update(sum(len(line.encode("utf-8")) for line in batch))
+                    batch = []
+            if batch:
+                yield batch
+                pbar.update(sum(len(line.encode("utf-8")) for line in batch))
+
+    @contextmanager
+    def open_text(self, text=None):
+        """
+        Opens the input file for reading, or the text already in memory.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Yields:
+            tuple: The text stream and its size in bytes, for the progress bar.
+        """
+        if text is not None:
+            yield io.StringIO(text), len(text.encode("utf-8"))
+            return
+
+        with open(self.input_file, "r", encoding="utf-8") as f:
+            yield f, os.path.getsize(self.input_file)
+
+
+def add_token_id_counts(tokenizer, lines, histogram):
+    """
+    Tokenizes a batch of lines and adds the count of each token ID to a
+    vocabulary-sized histogram.
+
+    Args:
+        tokenizer (PreTrainedTokenizerFast): The tokenizer to use.
+        lines (list): The lines to tokenize.
+        histogram (ndarray): The count of each token ID, updated in place.
+    """
+    encodings = tokenizer(
+        lines,
+        add_special_tokens=False,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+    )
+    token_ids = np.fromiter(chain.from_iterable(encodings["input_ids"]), dtype=np.int64)
+    batch_counts = np.bincount(token_ids)
+    histogram[: len(batch_counts)] += batch_counts
+
+
+def refine_token_histogram(tokenizer, histogram):
+    """
+    Maps the token IDs counted in a histogram back to tokens and refines them.
+
+    Args:
+        tokenizer (PreTrainedTokenizerFast): The tokenizer the IDs come from.
+        histogram (ndarray): The count of each token ID.
+
+    Returns:
+        Counter: The count of each refined token.
+    """
+    token_ids = np.flatnonzero(histogram)
+    token_id_counts = Counter(
+        dict(zip(token_ids.tolist(), histogram[token_ids].tolist()))
+    )
+    return refine_token_counts(tokenizer, token_id_counts)
+
+
+def refine_token_counts(tokenizer, token_id_counts):
+    """
+    Maps counted token IDs back to tokens and refines each distinct token with the
+    regular expression once.
+
+    Args:
+        tokenizer (PreTrainedTokenizerFast): The tokenizer the IDs come from.
+        token_id_counts (Counter): The count of each token ID.
+
+    Returns:
+        Counter: The count of each refined token.
+    """
+    token_ids = list(token_id_counts)
+    tokens = tokenizer.convert_ids_to_tokens(token_ids)
+
+    refined_counts = Counter()
+    for token_id, token in zip(token_ids, tokens):
+        for refined_token in TOKEN_PATTERN.findall(token.lower()):
+            refined_counts[refined_token] += token_id_counts[token_id]
+    return refined_counts
@@ -0,0 +1,242 @@
+import csv
+import io
+import os
+from abc import ABC, abstractmethod
+from collections import Counter
+
+import numpy as np
+from tqdm import tqdm
+from transformers import AutoTokenizer
+
+from my_modules.metrics import input_counts, metrics
+from my_modules.model_registry import model_registry
+from my_modules.q1_t3_1_most_common_words import WORD_PATTERN, split_at_last_whitespace
+from my_modules.q1_t3_2_most_common_tokens import (
+    add_token_id_counts,
+    refine_token_histogram,
+)
+
+
+class TextAnalyzer(ABC):
+    """
+    The base class of the analyzers run by FusedTextAnalytics. An analyzer is fed
+    the text one block at a time and writes its results to a CSV file at the end.
+
+    Every block ends on whitespace, so nothing that an analyzer counts within
+    words or between whitespace is split between two blocks.
+    """
+
+    # Whether the analyzer is fed the lowercased text
+    lowercase = False
+
+    def __init__(self, output_file, top_n):
+        """
+        Initialize the analyzer.
+
+        Args:
+            output_file (str): Path where the output CSV file will be saved.
+            top_n (int): Number of top entries to save.
+        """
+        self.output_file = output_file
+        self.top_n = top_n
+
+    @abstractmethod
+    def update(self, text):
+        """
+        Analyzes the next block of text.
+        """
+
+    @abstractmethod
+    def save(self):
+        """
+        Writes the results to the output CSV file.
+        """
+
+    def write_counts(self, header, counts):
+        """
+        Writes the top N entries of a Counter to the output CSV file.
+        """
+        with open(self.output_file, "w", newline="", encoding="utf-8") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(header)
+            writer.writerows(counts.most_common(self.top_n))
+        print(f"Top {self.top_n} {header[0].lower()}s saved to: {self.output_file}")
+
+
+class WordCountAnalyzer(TextAnalyzer):
+    """
+    Counts the words of the text, like TopWordsExtractor.
+    """
+
+    lowercase = True
+
+    def __init__(self, output_file, top_n):
+        super().__init__(output_file, top_n)
+        self.word_counts = Counter()
+
+    def update(self, text):
+        self.word_counts.update(WORD_PATTERN.findall(text))
+
+    def save(self):
+        self.write_counts(["Word", "Count"], self.word_counts)
+
+
+class TokenCountAnalyzer(TextAnalyzer):
+    """
+    Counts the refined subword tokens of the text, like UniqueTokenCounter with the
+    'bincount' engine. The token IDs of each block are added to a vocabulary-sized
+    histogram, and only mapped back to tokens and refined at the end.
+    """
+
+    def __init__(self, output_file, top_n, model_name, batch_size=1000):
+        """
+        Initialize the TokenCountAnalyzer instance.
+
+        Args:
+            output_file (str): Path where the output CSV file will be saved.
+            top_n (int): Number of top tokens to save.
+            model_name (str): Pretrained model name for the tokenizer.
+            batch_size (int): Number of lines per call to the tokenizer.
+        """
+        super().__init__(output_file, top_n)
+        self.batch_size = batch_size
+        self.tokenizer = model_registry.get(
+            ("tokenizer", model_name),
+            lambda: AutoTokenizer.from_pretrained(model_name, use_fast=True),
+        )
+        self.histogram = np.zeros(len(self.tokenizer), dtype=np.int64)
+
+    def update(self, text):
+        lines = text.splitlines(keepends=True)
+        for start in range(0, len(lines), self.batch_size):
+            add_token_id_counts(
+                self.tokenizer, lines[start : start + self.batch_size], self.histogram
+            )
+
+    def save(self):
+        self.write_counts(
+            ["Token", "Count"], refine_token_histogram(self.tokenizer, self.histogram)
+        )
+
+
+class CharNgramAnalyzer(TextAnalyzer):
+    """
+    Counts the character n-grams within the words of the text, as a profile of the
+    corpus' spelling.
+    """
+
+    lowercase = True
+
+    def __init__(self, output_file, top_n, n=3):
+        """
+        Initialize the CharNgramAnalyzer instance.
+
+        Args:
+            output_file (str): Path where the output CSV file will be saved.
+            top_n (int): Number of top n-grams to save.
+            n (int): Number of characters per n-gram.
+        """
+        super().__init__(output_file, top_n)
+        self.n = n
+        self.ngram_counts = Counter()
+
+    def update(self, text):
+        n = self.n
+        self.ngram_counts.update(
+            word[i : i + n]
+            for word in WORD_PATTERN.findall(text)
+            for i in range(len(word) - n + 1)
+        )
+
+    def save(self):
+        self.write_counts(["N-gram", "Count"], self.ngram_counts)
+
+
+class FusedTextAnalytics:
+    """
+    A class to read a text file once and feed each block of it to several
+    analyzers, instead of each analysis reading, decoding and lowercasing the file
+    separately.
+    """
+
+    def __init__(self, input_file, analyzers, block_size=1024 * 1024):
+        """
+        Initialize the FusedTextAnalytics instance.
+
+        Args:
+            input_file (str): Path to the text file to analyze.
+            analyzers (list): The TextAnalyzer instances to feed.
+            block_size (int): Number of characters to read at a time.
+        """
+        self.input_file = input_file
+        self.analyzers = analyzers
+        self.block_size = block_size
+
+    def run(self, text=None):
+        """
+        Streams the input file through the analyzers and saves their results.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory. The file is then not read again.
+        """
+        # Check if the input file exists
+        if text is None and not os.path.isfile(self.input_file):
+            print(f"Error: The file '{self.input_file}' does not exist.")
+            return
+
+        # Check if each output directory exists; create it if not
+        for analyzer in self.analyzers:
+            output_dir = os.path.dirname(analyzer.output_file)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+                print(f"Created the output directory: {output_dir}")
+
+        needs_lowercase = any(analyzer.lowercase for analyzer in self.analyzers)
+        with metrics.stage(
+            "text_analytics", **input_counts(self.input_file, text)
+        ) as stage:
+            for block in self.iter_blocks(text):
+                # Lowercase each block once for all the analyzers that need it
+                lowered = block.lower() if needs_lowercase else None
+                for analyzer in self.analyzers:
+                    analyzer.update(lowered if analyzer.lowercase else block)
+                stage.add(blocks=1)
+
+        for analyzer in self.analyzers:
+            analyzer.save()
+
+    def iter_blocks(self, text=None):
+        """
+        Reads the input file in blocks of about `block_size` characters that each
+        end on whitespace, carrying any partial word over to the next block.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory.
+
+        Yields:
+            str: The next block.
+        """
+        if text is not None:
+            f = io.StringIO(text)
+            total_size = len(text)
+            unit = "char"
+        else:
+            f = open(self.input_file, "r", encoding="utf-8")
+            total_size = os.path.getsize(self.input_file)
+            unit = "B"
+
+        with f, tqdm(
+            total=total_size, unit=unit, unit_scale=True, desc="Analyzing Text"
+        ) as pbar:
+            carry = ""
+            for raw_block in iter(lambda: f.read(self.block_size), ""):
+                pbar.update(
+                    len(raw_block) if unit == "char" else len(raw_block.encode("utf-8"))
+                )
+                block, carry = split_at_last_whitespace(carry + raw_block)
+                if block:
+                    yield block
+            if carry:
+                yield carry
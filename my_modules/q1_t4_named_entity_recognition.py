@@ -1,15 +1,27 @@
 import csv
+import multiprocessing
 import os
+import re
+import time
 import warnings
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 import spacy
-import torch
 from tqdm import tqdm
-from transformers import AutoModelForTokenClassification, AutoTokenizer, pipeline
+
+from my_modules.metrics import input_counts, metrics
+from my_modules.model_registry import model_registry
+from my_modules.ner_cache import NERChunkCache
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
+# torch and transformers are imported in the BioBERT methods that use them, so
+# that scispaCy runs without loading or even installing them
+
+# Sentence boundaries: end punctuation followed by whitespace, or line breaks
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"[.!?]\s+|\n+")
+
 
 class NERProcessor:
     """
@@ -17,7 +29,24 @@ class NERProcessor:
     and extract counts of diseases and drugs from a text file.
     """
 
-    def __init__(self, input_file, output_file, model_name, model_type):
+    def __init__(
+        self,
+        input_file,
+        output_file,
+        model_name,
+        model_type,
+        batch_size=8,
+        chunking="characters",
+        stride=64,
+        backend="pytorch",
+        onnx_dir=None,
+        n_process=1,
+        pipe_batch_size=1000,
+        workers=1,
+        threads_per_worker=None,
+        cache_file=None,
+        cache_max_bytes=1024 * 1024 * 1024,
+    ):
         """
         Initialize the NERProcessor instance with the specified model.
 
@@ -26,40 +55,141 @@ class NERProcessor:
             output_file (str): Path where the output CSV file will be saved.
             model_name (str): The pretrained model to use.
             model_type (str): The type of model ('biobert' or 'scispacy').
+            batch_size (int): Number of chunks per forward pass for BioBERT.
+            chunking (str): How to split the text for BioBERT ('characters' for
+                512-character chunks, or 'tokens' for sentence-aligned windows that
+                fill the model's maximum token length).
+            stride (int): Maximum number of tokens of whole sentences repeated at the
+                start of each window when `chunking` is 'tokens'.
+            backend (str): The BioBERT inference backend ('pytorch' for the
+                full-precision model, 'quantized' for dynamic int8 quantization of
+                its linear layers on CPU, or 'onnx' for an exported ONNX Runtime
+                graph, which requires `optimum[onnxruntime]`).
+            onnx_dir (str, optional): Directory to save the exported ONNX model to and
+                load it from on later runs. If None, the model is exported each time.
+            n_process (int): Number of processes for scispaCy's `nlp.pipe`.
+            pipe_batch_size (int): Number of texts per batch for scispaCy's
+                `nlp.pipe`.
+            workers (int): Number of BioBERT worker processes. If greater than 1,
+                each worker loads its own copy of the model and processes a share
+                of the chunks, and this process only loads the tokenizer and the
+                model configuration until it runs the model itself.
+            threads_per_worker (int, optional): Number of torch threads in each
+                worker. Defaults to the number of CPUs divided by `workers`.
+            cache_file (str, optional): If given, the entities found in each chunk
+                are cached in this SQLite database, keyed by the chunk's text and the
+                model settings, so that a rerun only processes new or changed chunks.
+            cache_max_bytes (int): Maximum size of the cached entities in bytes.
         """
         self.input_file = input_file
         self.output_file = output_file
         self.model_name = model_name
         self.model_type = model_type.lower()
+        self.batch_size = batch_size
+        self.chunking = chunking.lower()
+        self.stride = stride
+        self.backend = backend.lower()
+        self.onnx_dir = onnx_dir
+        self.n_process = n_process
+        self.pipe_batch_size = pipe_batch_size
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.cache_file = cache_file
+        self.cache_max_bytes = cache_max_bytes
+        self.show_progress = True
 
         if self.model_type == "biobert":
-            self.model, self.tokenizer = self.load_biobert_model_and_tokenizer()
-            # Use the Hugging Face pipeline for token classification
-            self.ner_pipeline = pipeline(
-                "ner",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                device=0 if torch.cuda.is_available() else -1,
-                batch_size=8,  # Adjust batch size as needed
+            from transformers import AutoConfig, AutoTokenizer
+
+            if self.backend not in ("pytorch", "quantized", "onnx"):
+                raise ValueError(
+                    "Invalid backend. Choose 'pytorch', 'quantized' or 'onnx'."
+                )
+
+            self.tokenizer = model_registry.get(
+                ("tokenizer", self.model_name),
+                lambda: AutoTokenizer.from_pretrained(self.model_name),
             )
+            self.model_config = AutoConfig.from_pretrained(self.model_name)
+
+            # With several workers, each worker loads its own model, so this
+            # process only loads one when it runs the model itself
+            self.model = None
+            self.ner_pipeline = None
+            if self.workers <= 1:
+                self.load_biobert_pipeline()
         elif self.model_type == "scispacy":
-            self.ner_model = spacy.load(self.model_name)
-            self.ner_model.max_length = 1500000  # Set the maximum length for processing
+            self.ner_model = model_registry.get(
+                ("spacy", self.model_name, "ner"), self.load_scispacy_model
+            )
         else:
             raise ValueError("Invalid model_type. Choose 'biobert' or 'scispacy'.")
 
-    def load_biobert_model_and_tokenizer(self):
+    def load_scispacy_model(self):
+        """
+        Loads the scispaCy pipeline with only the components needed for NER.
+
+        Returns:
+            Language: The loaded pipeline.
+        """
+        ner_model = spacy.load(self.model_name)
+        ner_model.max_length = 1500000  # Set the maximum length for processing
+
+        # Only the NER component and the embedding layer it listens to are needed
+        ner_model.select_pipes(
+            disable=[
+                name for name in ner_model.pipe_names if name not in ("tok2vec", "ner")
+            ]
+        )
+        return ner_model
+
+    def load_biobert_pipeline(self):
         """
-        Loads the tokenizer and model for the specified BioBERT model.
+        Gets the BioBERT model for the selected backend from the model registry,
+        loading it on first use, and wraps it in a Hugging Face NER pipeline.
+        """
+        import torch
+        from transformers import pipeline
+
+        self.model = model_registry.get(
+            ("token-classification", self.model_name, self.backend, self.onnx_dir),
+            self.load_biobert_model,
+        )
+        # Use the Hugging Face pipeline for token classification
+        self.ner_pipeline = pipeline(
+            "ner",
+            model=self.model,
+            tokenizer=self.tokenizer,
+            device=(
+                0 if self.backend == "pytorch" and torch.cuda.is_available() else -1
+            ),
+            batch_size=self.batch_size,
+        )
+
+    def load_biobert_model(self):
+        """
+        Loads the BioBERT model for the selected backend.
 
         Returns:
             model: The loaded model.
-            tokenizer: The loaded tokenizer.
         """
-        # Load the tokenizer and model
-        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if self.backend == "onnx":
+            return self.load_biobert_onnx_model()
+
+        import torch
+        from transformers import AutoModelForTokenClassification
+
         model = AutoModelForTokenClassification.from_pretrained(self.model_name)
 
+        if self.backend == "quantized":
+            # Store the weights of the linear layers as int8 and quantize the
+            # activations on the fly
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            print("Running BioBERT model on CPU with dynamic int8 quantization")
+            return model
+
         # Move the model to GPU if available
         if torch.cuda.is_available():
             model = model.to("cuda")
@@ -67,14 +197,125 @@ class NERProcessor:
         else:
             print("Running BioBERT model on CPU")
 
-        return model, tokenizer
+        return model
+
+    def load_biobert_onnx_model(self):
+        """
+        Loads the BioBERT model as an ONNX Runtime graph, exporting it from the
+        PyTorch weights unless it was already exported to `onnx_dir`.
 
-    def perform_ner(self):
+        Returns:
+            model: The ONNX Runtime model.
+        """
+        try:
+            from optimum.onnxruntime import ORTModelForTokenClassification
+        except ImportError as e:
+            raise ImportError(
+                "The 'onnx' backend requires optimum with ONNX Runtime. "
+                "Install it with: pip install optimum[onnxruntime]"
+            ) from e
+
+        if self.onnx_dir and os.path.isdir(self.onnx_dir):
+            model = ORTModelForTokenClassification.from_pretrained(self.onnx_dir)
+        else:
+            model = ORTModelForTokenClassification.from_pretrained(
+                self.model_name, export=True
+            )
+            if self.onnx_dir:
+                model.save_pretrained(self.onnx_dir)
+                print(f"Exported the ONNX model to {self.onnx_dir}")
+
+        print("Running BioBERT model on CPU with ONNX Runtime")
+        return model
+
+    def check_backend_parity(self, sample_text, reference_backend="pytorch"):
+        """
+        Compares this processor's backend against a reference backend on a sample
+        of text, reporting the speed of each and how closely their entity counts
+        agree.
+
+        Args:
+            sample_text (str): The text to run both backends on.
+            reference_backend (str): The backend to compare against.
+
+        Returns:
+            dict: The timings of both backends and the agreement of their counts.
+
+        Raises:
+            ValueError: If the reference backend is this processor's backend.
+        """
+        reference_backend = reference_backend.lower()
+        if reference_backend == self.backend:
+            raise ValueError(
+                f"The '{self.backend}' backend cannot be compared with itself. "
+                "Choose a different reference backend."
+            )
+
+        reference = NERProcessor(
+            self.input_file,
+            self.output_file,
+            self.model_name,
+            "biobert",
+            batch_size=self.batch_size,
+            chunking=self.chunking,
+            stride=self.stride,
+            backend=reference_backend,
+            onnx_dir=self.onnx_dir,
+        )
+
+        results = {}
+        for name, processor in ((reference_backend, reference), (self.backend, self)):
+            start_time = time.perf_counter()
+            diseases_counts, drugs_counts = processor.process_text_biobert(sample_text)
+            results[name] = {
+                "seconds": time.perf_counter() - start_time,
+                "diseases": diseases_counts,
+                "drugs": drugs_counts,
+            }
+
+        report = {
+            "reference_seconds": results[reference_backend]["seconds"],
+            "backend_seconds": results[self.backend]["seconds"],
+        }
+        report["speedup"] = report["reference_seconds"] / max(
+            report["backend_seconds"], 1e-9
+        )
+
+        print(f"\nBackend parity: {self.backend} vs {reference_backend}")
+        print(
+            f"{reference_backend}: {report['reference_seconds']:.2f}s, "
+            f"{self.backend}: {report['backend_seconds']:.2f}s "
+            f"({report['speedup']:.2f}x)"
+        )
+        for entity_type in ("diseases", "drugs"):
+            reference_counts = results[reference_backend][entity_type]
+            backend_counts = results[self.backend][entity_type]
+
+            # Share of the entity occurrences both backends agree on
+            words = set(reference_counts) | set(backend_counts)
+            agreed = sum(min(reference_counts[w], backend_counts[w]) for w in words)
+            total = sum(max(reference_counts[w], backend_counts[w]) for w in words)
+            agreement = agreed / total if total else 1.0
+            report[f"{entity_type}_agreement"] = agreement
+
+            print(
+                f"{entity_type.capitalize()}: {sum(reference_counts.values())} vs "
+                f"{sum(backend_counts.values())} entities, "
+                f"{agreement:.1%} agreement"
+            )
+
+        return report
+
+    def perform_ner(self, text=None):
         """
         Performs NER on the input file and saves the results to the output file.
+
+        Args:
+            text (str, optional): The content of the input file, if it is already
+                in memory. The file is then not read again.
         """
         # Check if the input file exists
-        if not os.path.isfile(self.input_file):
+        if text is None and not os.path.isfile(self.input_file):
             print(f"Error: The file '{self.input_file}' does not exist.")
             return
 
@@ -84,18 +325,23 @@ class NERProcessor:
             os.makedirs(output_dir)
             print(f"Created the output directory: {output_dir}")
 
-        # Load the text from the file
-        with open(self.input_file, "r", encoding="utf-8") as text_file:
-            text = text_file.read()
+        with metrics.stage(
+            f"ner_{self.model_type}", **input_counts(self.input_file, text)
+        ) as stage:
+            # Load the text from the file
+            if text is None:
+                with open(self.input_file, "r", encoding="utf-8") as text_file:
+                    text = text_file.read()
 
-        if self.model_type == "biobert":
-            # Process the text using BioBERT
-            diseases_counts, drugs_counts = self.process_text_biobert(text)
-        elif self.model_type == "scispacy":
-            # Process the text using scispaCy
-            diseases_counts, drugs_counts = self.process_text_scispacy(text)
-        else:
-            raise ValueError("Invalid model_type. Choose 'biobert' or 'scispacy'.")
+            if self.model_type == "biobert":
+                # Process the text using BioBERT
+                diseases_counts, drugs_counts = self.process_text_biobert(text)
+            elif self.model_type == "scispacy":
+                # Process the text using scispaCy
+                diseases_counts, drugs_counts = self.process_text_scispacy(text)
+            else:
+                raise ValueError("Invalid model_type. Choose 'biobert' or 'scispacy'.")
+            stage.add(entities=diseases_counts.total() + drugs_counts.total())
 
         # Save the results to a CSV file
         self.save_counts_to_csv(self.output_file, diseases_counts, drugs_counts)
@@ -110,40 +356,486 @@ class NERProcessor:
         Returns:
             tuple: Counters for diseases and drugs.
         """
-        diseases_counts = Counter()
-        drugs_counts = Counter()
+        with metrics.stage("ner_chunking", chars=len(text)) as stage:
+            text_chunks, skip_chars = self.make_biobert_chunks(text)
+            stage.add(chunks=len(text_chunks))
 
-        # Split the text into chunks of size 512 for processing
-        chunk_size = 512
-        text_chunks = [
-            text[i : i + chunk_size] for i in range(0, len(text), chunk_size)
+        print(f"Total number of chunks: {len(text_chunks)}")
+
+        if self.workers > 1:
+            run_chunks = self.run_biobert_sharded
+        else:
+            run_chunks = self.run_biobert_on_chunks
+
+        with metrics.stage("ner_inference", chunks=len(text_chunks)):
+            chunk_entities = self.run_with_cache(text_chunks, skip_chars, run_chunks)
+        return count_chunk_entities(chunk_entities)
+
+    def run_with_cache(self, text_chunks, skip_chars, run_chunks):
+        """
+        Finds the entities of each chunk, taking those of unchanged chunks from the
+        chunk cache and running the model only on the others. Without a
+        `cache_file`, the model runs on all chunks.
+
+        Args:
+            text_chunks (list): The text chunks to process.
+            skip_chars (list): For each chunk, the number of leading characters
+                whose entities were already counted in the previous chunk.
+            run_chunks (callable): Runs the model on a list of chunks and their skip
+                counts, and returns a (diseases, drugs) tuple for each chunk.
+
+        Returns:
+            list: A (diseases, drugs) tuple of entity lists for each chunk.
+        """
+        if not self.cache_file:
+            return run_chunks(text_chunks, skip_chars)
+
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        cache = NERChunkCache(self.cache_file, self.cache_max_bytes)
+        settings = [
+            self.model_type,
+            self.model_name,
+            self.backend,
+            self.chunking,
+            self.stride,
+        ]
+        keys = [
+            cache.make_key(settings, skip, chunk)
+            for chunk, skip in zip(text_chunks, skip_chars)
         ]
 
-        for chunk in tqdm(
-            text_chunks, desc="Processing Chunks with BioBERT", unit="chunk"
-        ):
-            # Run NER on the chunk
-            ner_results = self.ner_pipeline(chunk)
+        cached = cache.get_many(keys)
+        missing = [index for index, key in enumerate(keys) if key not in cached]
+        print(
+            f"Found {len(text_chunks) - len(missing)} chunks in the cache, "
+            f"processing {len(missing)}"
+        )
 
-            # Combine subword tokens into full entities
-            combined_entities = self.combine_entities_biobert(ner_results)
+        chunk_entities = [cached.get(key) for key in keys]
+        if missing:
+            new_entities = run_chunks(
+                [text_chunks[index] for index in missing],
+                [skip_chars[index] for index in missing],
+            )
+            for index, entities in zip(missing, new_entities):
+                chunk_entities[index] = entities
+            cache.put_many(
+                (keys[index], entities)
+                for index, entities in zip(missing, new_entities)
+            )
 
-            if combined_entities is None:
-                continue  # Skip if there are no entities
+        return chunk_entities
 
-            # Filter entities based on labels
-            diseases = [
-                entity[0] for entity in combined_entities if "Disease" in entity[1]
-            ]
-            drugs = [
-                entity[0] for entity in combined_entities if "Chemical" in entity[1]
+    def make_biobert_chunks(self, text):
+        """
+        Splits the text into chunks for BioBERT, as selected by `chunking`.
+
+        Args:
+            text (str): The text to split.
+
+        Returns:
+            tuple: The text chunks, and for each chunk the number of leading
+                characters already covered by the previous chunk.
+        """
+        if self.chunking == "tokens":
+            # Split the text into sentence-aligned windows of up to the model's
+            # maximum token length
+            windows = self.make_token_windows(text)
+            text_chunks = [text[start:end] for start, end, _ in windows]
+            skip_chars = [skip for _, _, skip in windows]
+        else:
+            # Split the text into chunks of size 512 for processing
+            chunk_size = 512
+            text_chunks = [
+                text[i : i + chunk_size] for i in range(0, len(text), chunk_size)
             ]
+            skip_chars = [0] * len(text_chunks)
+
+        return text_chunks, skip_chars
+
+    def run_biobert_sharded(self, text_chunks, skip_chars, executor=None):
+        """
+        Runs BioBERT over the chunks in `workers` processes, each with its own copy
+        of the model and `threads_per_worker` torch threads.
 
-            # Update counters
-            diseases_counts.update(diseases)
-            drugs_counts.update(drugs)
+        The chunks are split into contiguous slices, and the entities of the
+        slices are put back in order, so the results match a single-process run.
 
-        return diseases_counts, drugs_counts
+        Args:
+            text_chunks (list): The text chunks to process.
+            skip_chars (list): For each chunk, the number of leading characters
+                whose entities were already counted in the previous chunk.
+            executor (ProcessPoolExecutor, optional): Workers started with
+                `start_biobert_workers`. If None, workers are started for this call.
+
+        Returns:
+            list: A (diseases, drugs) tuple of entity lists for each chunk.
+        """
+        if executor is None:
+            with self.start_biobert_workers() as executor:
+                return self.run_biobert_sharded(text_chunks, skip_chars, executor)
+
+        # Use a few slices per worker so that the workers finish close together
+        slice_size = max(1, -(-len(text_chunks) // (self.workers * 4)))
+        futures = [
+            executor.submit(
+                run_biobert_slice,
+                text_chunks[start : start + slice_size],
+                skip_chars[start : start + slice_size],
+            )
+            for start in range(0, len(text_chunks), slice_size)
+        ]
+
+        chunk_entities = []
+        for future in tqdm(
+            futures,
+            desc=f"Processing Slices with {self.workers} BioBERT Workers",
+            unit="slice",
+        ):
+            chunk_entities.extend(future.result())
+
+        return chunk_entities
+
+    def start_biobert_workers(self):
+        """
+        Creates a pool of `workers` processes that each load a copy of the BioBERT
+        model with `threads_per_worker` torch threads.
+
+        Returns:
+            ProcessPoolExecutor: The worker pool.
+        """
+        threads = self.threads_per_worker or max(
+            1, (os.cpu_count() or 1) // self.workers
+        )
+
+        # Spawn fresh processes, as forking a process that has used torch threads
+        # is not safe
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=init_biobert_worker,
+            initargs=(self.worker_settings(), threads, context.Barrier(self.workers)),
+        )
+
+    def warm_up_biobert_workers(self, executor, text_chunks):
+        """
+        Runs a throwaway chunk in every worker, so that every worker has started,
+        loaded its model and run it once, and later timings only measure inference.
+
+        Args:
+            executor (ProcessPoolExecutor): Workers started with
+                `start_biobert_workers`.
+            text_chunks (list): The chunks to run; only the first one is used.
+        """
+        futures = [
+            executor.submit(warm_up_biobert_worker, text_chunks[:1])
+            for _ in range(self.workers)
+        ]
+        for future in futures:
+            future.result()
+
+    def worker_settings(self):
+        """
+        Returns the arguments needed to create an equivalent single-process BioBERT
+        processor in a worker process.
+
+        Returns:
+            dict: The keyword arguments for NERProcessor.
+        """
+        return {
+            "input_file": self.input_file,
+            "output_file": self.output_file,
+            "model_name": self.model_name,
+            "model_type": "biobert",
+            "batch_size": self.batch_size,
+            "chunking": self.chunking,
+            "stride": self.stride,
+            "backend": self.backend,
+            "onnx_dir": self.onnx_dir,
+        }
+
+    def tune_biobert_sharding(self, sample_text, configurations):
+        """
+        Measures the BioBERT throughput on a sample of text for different numbers
+        of worker processes and torch threads per worker, and prints a report.
+
+        The sample is split into chunks once. For each configuration, the model is
+        loaded and run on a throwaway chunk in every worker before the timing
+        starts, so only inference is timed and loading a model per worker does not
+        count against configurations with more workers. The sample should be large
+        enough to keep every worker busy for several seconds.
+
+        Args:
+            sample_text (str): The text to process for each configuration.
+            configurations (list): (workers, threads per worker) tuples to try.
+
+        Returns:
+            list: A dict with the workers, threads, seconds and chunks/s of each
+                configuration.
+        """
+        import torch
+
+        text_chunks, skip_chars = self.make_biobert_chunks(sample_text)
+        workers, threads_per_worker = self.workers, self.threads_per_worker
+        torch_threads = torch.get_num_threads()
+
+        report = []
+        try:
+            for config_workers, config_threads in configurations:
+                self.workers = config_workers
+                self.threads_per_worker = config_threads
+
+                if config_workers == 1:
+                    torch.set_num_threads(config_threads)
+                    self.run_biobert_on_chunks(text_chunks[:1], skip_chars[:1])
+
+                    start_time = time.perf_counter()
+                    self.run_biobert_on_chunks(text_chunks, skip_chars)
+                    elapsed = time.perf_counter() - start_time
+                else:
+                    with self.start_biobert_workers() as executor:
+                        self.warm_up_biobert_workers(executor, text_chunks)
+
+                        start_time = time.perf_counter()
+                        self.run_biobert_sharded(text_chunks, skip_chars, executor)
+                        elapsed = time.perf_counter() - start_time
+
+                report.append(
+                    {
+                        "workers": config_workers,
+                        "threads": config_threads,
+                        "seconds": elapsed,
+                        "chunks_per_second": len(text_chunks) / max(elapsed, 1e-9),
+                    }
+                )
+        finally:
+            self.workers, self.threads_per_worker = workers, threads_per_worker
+            torch.set_num_threads(torch_threads)
+
+        print(f"\nBioBERT sharding report ({len(text_chunks)} chunks)")
+        print(f"{'Workers':>8} {'Threads':>8} {'Seconds':>10} {'Chunks/s':>10}")
+        for row in report:
+            print(
+                f"{row['workers']:>8} {row['threads']:>8} "
+                f"{row['seconds']:>10.2f} {row['chunks_per_second']:>10.2f}"
+            )
+
+        return report
+
+    def make_token_windows(self, text):
+        """
+        Splits the text into windows of whole sentences that fit in the model's
+        maximum token length. Each window after the first starts with up to
+        `stride` tokens of the sentences that ended the previous window, so that
+        entities near a border are seen with context on both sides.
+
+        Sentences longer than the maximum are split between words.
+
+        Args:
+            text (str): The text to split.
+
+        Returns:
+            list: A (start, end, skip) tuple for each window, where start and end are
+                character offsets into the text, and skip is the number of leading
+                characters already covered by the previous window.
+        """
+        # Leave room for the [CLS] and [SEP] tokens
+        max_tokens = (
+            min(
+                self.tokenizer.model_max_length,
+                self.model_config.max_position_embeddings,
+            )
+            - 2
+        )
+
+        # Find the sentences, and split those that are too long
+        boundaries = [0]
+        boundaries.extend(
+            match.end() for match in SENTENCE_BOUNDARY_PATTERN.finditer(text)
+        )
+        if boundaries[-1] != len(text):
+            boundaries.append(len(text))
+        sentences = [
+            (start, end)
+            for start, end in zip(boundaries, boundaries[1:])
+            if text[start:end].strip()
+        ]
+
+        pieces = []
+        for batch_start in range(0, len(sentences), 10000):
+            batch = sentences[batch_start : batch_start + 10000]
+            encodings = self.tokenizer(
+                [text[start:end] for start, end in batch],
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+            )
+            for (start, end), offsets in zip(batch, encodings["offset_mapping"]):
+                pieces.extend(self.split_sentence(start, end, offsets, max_tokens))
+
+        # Pack the pieces into windows
+        windows = []
+        window = []
+        window_tokens = 0
+        owned_start = 0
+        for piece in pieces:
+            if window and window_tokens + piece[2] > max_tokens:
+                windows.append((window[0][0], window[-1][1], owned_start))
+                owned_start = window[-1][1]
+
+                # Repeat the trailing sentences of the window, up to `stride` tokens
+                overlap = []
+                overlap_tokens = 0
+                for previous in reversed(window):
+                    if (
+                        overlap_tokens + previous[2] > self.stride
+                        or overlap_tokens + previous[2] + piece[2] > max_tokens
+                    ):
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous[2]
+                window = overlap
+                window_tokens = overlap_tokens
+
+            window.append(piece)
+            window_tokens += piece[2]
+
+        if window:
+            windows.append((window[0][0], window[-1][1], owned_start))
+
+        return [
+            (start, end, max(owned, start) - start) for start, end, owned in windows
+        ]
+
+    @staticmethod
+    def split_sentence(start, end, offsets, max_tokens):
+        """
+        Splits a sentence into pieces of at most `max_tokens` tokens, cutting between
+        words where possible.
+
+        Args:
+            start (int): Character offset of the sentence in the text.
+            end (int): Character offset of the end of the sentence in the text.
+            offsets (list): The (start, end) character offsets of each token,
+                relative to the sentence.
+            max_tokens (int): Maximum number of tokens per piece.
+
+        Returns:
+            list: A (start, end, token count) tuple for each piece.
+        """
+        if len(offsets) <= max_tokens:
+            return [(start, end, len(offsets))]
+
+        pieces = []
+        piece_start = 0
+        while len(offsets) - piece_start > max_tokens:
+            cut = piece_start + max_tokens
+
+            # Move the cut back to the start of a word, if there is one
+            for index in range(cut, piece_start, -1):
+                if offsets[index][0] > offsets[index - 1][1]:
+                    cut = index
+                    break
+
+            pieces.append(
+                (
+                    start + (offsets[piece_start][0] if pieces else 0),
+                    start + offsets[cut][0],
+                    cut - piece_start,
+                )
+            )
+            piece_start = cut
+        pieces.append(
+            (start + offsets[piece_start][0], end, len(offsets) - piece_start)
+        )
+        return pieces
+
+    def run_biobert_on_chunks(self, text_chunks, skip_chars=None):
+        """
+        Runs the BioBERT NER pipeline over the chunks in batches of `batch_size`.
+
+        The chunks are fed to the pipeline sorted by token length, so that chunks
+        of similar length are padded together, and the results are put back in the
+        original order.
+
+        Args:
+            text_chunks (list): The text chunks to process.
+            skip_chars (list, optional): For each chunk, the number of leading
+                characters whose entities were already counted in the previous
+                chunk and must be skipped.
+
+        Returns:
+            list: A (diseases, drugs) tuple of entity lists for each chunk.
+        """
+        if self.ner_pipeline is None:
+            self.load_biobert_pipeline()
+
+        # Sort the chunks by token length to cut padding waste
+        token_lengths = []
+        for start in range(0, len(text_chunks), 10000):
+            encodings = self.tokenizer(text_chunks[start : start + 10000])
+            token_lengths.extend(len(ids) for ids in encodings["input_ids"])
+        order = sorted(range(len(text_chunks)), key=token_lengths.__getitem__)
+
+        chunk_entities = [None] * len(text_chunks)
+        start_time = time.perf_counter()
+
+        # Feed the pipeline from a generator so that it batches across chunks
+        outputs = self.ner_pipeline(
+            (text_chunks[index] for index in order), batch_size=self.batch_size
+        )
+        for index, ner_results in zip(
+            order,
+            tqdm(
+                outputs,
+                total=len(text_chunks),
+                desc="Processing Chunks with BioBERT",
+                unit="chunk",
+                disable=not self.show_progress,
+            ),
+        ):
+            skip = skip_chars[index] if skip_chars else 0
+            chunk_entities[index] = self.filter_entities_biobert(ner_results, skip)
+
+        elapsed = time.perf_counter() - start_time
+        if elapsed > 0 and self.show_progress:
+            print(
+                f"Processed {len(text_chunks)} chunks in {elapsed:.1f}s "
+                f"({len(text_chunks) / elapsed:.2f} chunks/s, "
+                f"batch size {self.batch_size})"
+            )
+
+        return chunk_entities
+
+    def filter_entities_biobert(self, ner_results, skip=0):
+        """
+        Combines the subword tokens of a chunk's NER results and splits the entities
+        into diseases and drugs.
+
+        Args:
+            ner_results (list): List of NER results from the BioBERT pipeline.
+            skip (int): Tokens starting before this character offset are dropped,
+                because they were counted in the previous, overlapping chunk.
+
+        Returns:
+            tuple: Lists of disease and drug entities.
+        """
+        if skip:
+            ner_results = [result for result in ner_results if result["start"] >= skip]
+
+        # Combine subword tokens into full entities
+        combined_entities = self.combine_entities_biobert(ner_results)
+
+        if combined_entities is None:
+            return [], []  # No entities found
+
+        # Filter entities based on labels
+        diseases = [entity[0] for entity in combined_entities if "Disease" in entity[1]]
+        drugs = [entity[0] for entity in combined_entities if "Chemical" in entity[1]]
+        return diseases, drugs
 
     def combine_entities_biobert(self, ner_results):
         """
@@ -186,40 +878,59 @@ class NERProcessor:
         """
         Processes the text using the scispaCy NER model and extracts entities.
 
+        Each line of the text is a separate document. The documents are streamed
+        through `nlp.pipe` in batches of `pipe_batch_size`, using `n_process`
+        processes.
+
         Args:
             text (str): The text to process.
 
         Returns:
             tuple: Counters for diseases and drugs.
         """
-        diseases_counts = Counter()
-        drugs_counts = Counter()
+        # Split the text into line-sized documents for processing
+        texts = [line for line in text.splitlines() if line.strip()]
 
-        # Split the text into chunks for processing
-        chunk_size = 1500000  # As per original code
-        text_chunks = [
-            text[i : i + chunk_size] for i in range(0, len(text), chunk_size)
-        ]
+        print(f"Total number of documents: {len(texts)}")
 
-        print(f"Total number of chunks: {len(text_chunks)}")
-
-        for chunk in tqdm(
-            text_chunks, desc="Processing Chunks with scispaCy", unit="chunk"
-        ):
-            doc = self.ner_model(chunk)
+        with metrics.stage("ner_inference", chunks=len(texts)):
+            chunk_entities = self.run_with_cache(
+                texts, [0] * len(texts), self.run_scispacy_on_texts
+            )
+        return count_chunk_entities(chunk_entities)
 
-            # Extract tokens and their entity types from the NER model output
-            tokens_entities = [(token.text, token.ent_type_) for token in doc]
+    def run_scispacy_on_texts(self, texts, skip_chars=None):
+        """
+        Runs the scispaCy NER model over the documents with `nlp.pipe`.
 
-            # Separate diseases and drugs
-            diseases = [token[0] for token in tokens_entities if token[1] == "DISEASE"]
-            drugs = [token[0] for token in tokens_entities if token[1] == "CHEMICAL"]
+        Args:
+            texts (list): The documents to process.
+            skip_chars (list, optional): Unused, as the documents do not overlap.
 
-            # Update counters
-            diseases_counts.update(diseases)
-            drugs_counts.update(drugs)
+        Returns:
+            list: A (diseases, drugs) tuple of entity token lists for each document.
+        """
+        doc_entities = []
+        docs = self.ner_model.pipe(
+            texts, batch_size=self.pipe_batch_size, n_process=self.n_process
+        )
+        for doc in tqdm(
+            docs,
+            total=len(texts),
+            desc="Processing Documents with scispaCy",
+            unit="doc",
+        ):
+            # Collect the tokens of each entity, separating diseases and drugs
+            diseases = []
+            drugs = []
+            for ent in doc.ents:
+                if ent.label_ == "DISEASE":
+                    diseases.extend(token.text for token in ent)
+                elif ent.label_ == "CHEMICAL":
+                    drugs.extend(token.text for token in ent)
+            doc_entities.append((diseases, drugs))
 
-        return diseases_counts, drugs_counts
+        return doc_entities
 
     def save_counts_to_csv(self, output_file_path, diseases_counts, drugs_counts):
         """
@@ -243,3 +954,76 @@ class NERProcessor:
                 csv_writer.writerow(["Drug", word, count])
 
         print(f"Ordered word counts saved to {output_file_path}")
+
+
+# The BioBERT processor of a worker process and the barrier shared by the
+# workers, set by `init_biobert_worker`
+worker_processor = None
+worker_barrier = None
+
+
+def init_biobert_worker(settings, threads, barrier):
+    """
+    Loads a copy of the BioBERT model in a worker process with a bounded number of
+    torch threads.
+
+    Args:
+        settings (dict): The keyword arguments for NERProcessor.
+        threads (int): Number of torch threads for this worker.
+        barrier (Barrier): A barrier shared by all the workers, for warming up.
+    """
+    import torch
+
+    global worker_processor, worker_barrier
+    worker_barrier = barrier
+    torch.set_num_threads(threads)
+    worker_processor = NERProcessor(**settings)
+    worker_processor.show_progress = False
+
+
+def warm_up_biobert_worker(text_chunks):
+    """
+    Runs the model on a throwaway slice of chunks, then waits for all the other
+    workers to do the same, so that each worker runs exactly one warm-up. Runs in a
+    worker process.
+
+    Args:
+        text_chunks (list): The text chunks to process.
+    """
+    worker_processor.run_biobert_on_chunks(text_chunks, [0] * len(text_chunks))
+    worker_barrier.wait()
+
+
+def run_biobert_slice(text_chunks, skip_chars):
+    """
+    Finds the diseases and drugs in a slice of chunks. Runs in a worker process.
+
+    Args:
+        text_chunks (list): The text chunks to process.
+        skip_chars (list): For each chunk, the number of leading characters whose
+            entities were already counted in the previous chunk.
+
+    Returns:
+        list: A (diseases, drugs) tuple of entity lists for each chunk.
+    """
+    return worker_processor.run_biobert_on_chunks(text_chunks, skip_chars)
+
+
+def count_chunk_entities(chunk_entities):
+    """
+    Counts the diseases and drugs of all chunks. The chunks are counted in their
+    original order, so ties are ordered the same way however they were processed.
+
+    Args:
+        chunk_entities (list): A (diseases, drugs) tuple of entity lists for each
+            chunk.
+
+    Returns:
+        tuple: Counters for diseases and drugs.
+    """
+    diseases_counts = Counter()
+    drugs_counts = Counter()
+    for diseases, drugs in chunk_entities:
+        diseases_counts.update(diseases)
+        drugs_counts.update(drugs)
+    return diseases_counts, drugs_counts
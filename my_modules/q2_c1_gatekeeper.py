@@ -1,29 +1,64 @@
+import csv
+import glob
+import io
+import mmap
 import os
+import struct
+import tempfile
 import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 from PIL import Image
 
+from my_modules.metrics import metrics
+
 
 class ImageModifier:
     """
     A class to modify an image by adjusting its pixel values based on a generated number.
     """
 
-    def __init__(self, input_file, output_file):
+    # The output formats that the banded mode can write
+    tiled_extensions = (".png", ".jpeg", ".jpg", ".tif", ".tiff", ".webp")
+
+    def __init__(self, input_file, output_file, engine="numpy", tile_height=None):
         """
         Initialize the ImageModifier instance.
 
         Args:
             input_file (str): Path to the input image file.
             output_file (str): Path where the modified image will be saved.
+            engine (str): How to modify the pixels ('numpy' or 'python').
+            tile_height (int, optional): If given, the image is processed in bands of
+                this many rows instead of as a whole (see `modify_image_tiled`). Only
+                used by the 'numpy' engine.
         """
         self.input_file = input_file
         self.output_file = output_file
+        self.engine = engine.lower()
+        self.tile_height = tile_height
+
+        if self.engine not in ("numpy", "python"):
+            raise ValueError("Invalid engine. Choose 'numpy' or 'python'.")
+        if tile_height and not self.output_file.lower().endswith(self.tiled_extensions):
+            raise ValueError(
+                "Invalid output file for tile_height. Save a PNG, JPEG, TIFF or WebP "
+                "image."
+            )
 
-    def modify_image(self):
+    def modify_image(self, n=None):
         """
         Modifies the image by adjusting pixel values and saves the new image.
         Also calculates the sum of all red pixel values in the new image.
+
+        Args:
+            n (int, optional): The number to add to each pixel value. If None, it is
+                generated from the current time.
+
+        Returns:
+            int: The sum of all red pixel values, or None if the input file is missing.
         """
         # Check if the input file exists
         if not os.path.isfile(self.input_file):
@@ -36,12 +71,176 @@ class ImageModifier:
             os.makedirs(output_dir)
             print(f"Created the output directory: {output_dir}")
 
-        # Generate the number based on the current time
+        if n is None:
+            n = self.generate_number()
+
+        with Image.open(self.input_file) as image:
+            pixels = image.width * image.height
+
+        with metrics.stage(
+            "modify_image",
+            bytes_read=os.path.getsize(self.input_file),
+            pixels=pixels,
+        ):
+            if self.engine == "numpy" and self.tile_height:
+                sum_red_pixels = self.modify_image_tiled(n)
+            else:
+                # Load and convert the image to RGB
+                image = Image.open(self.input_file).convert("RGB")
+
+                # Modify each pixel and calculate the sum of all red pixels
+                # simultaneously
+                if self.engine == "numpy":
+                    new_image, sum_red_pixels = self.shift_pixels_numpy(image, n)
+                else:
+                    new_image, sum_red_pixels = self.shift_pixels_python(image, n)
+
+                # Save the new image
+                new_image.save(self.output_file)
+        print(f"Image saved to {self.output_file}")
+        print(f"The sum of all red pixels is: {sum_red_pixels}")
+
+        return sum_red_pixels
+
+    def modify_image_tiled(self, n):
+        """
+        Modifies the image in bands of `tile_height` rows and saves the new image.
+
+        Each band is decoded, shifted and handed to the output as soon as it is done,
+        while the red sum is kept as a running total. PNG output is compressed one
+        band at a time. For other formats Pillow's encoders need the whole image, so
+        the bands are written to a file-backed buffer that the encoder reads in place,
+        and the buffer's pages are released from memory as it goes. The saved pixels
+        and the red sum are identical to the in-memory path.
+
+        See `iter_image_bands` for which source images are decoded one band at a
+        time; JPEG and PNG sources are decoded in one piece.
+
+        Args:
+            n (int): The number to add to each pixel value.
+
+        Returns:
+            int: The sum of all red pixel values in the new image.
+        """
+        with Image.open(self.input_file) as image:
+            image_width, image_height = image.size
+
+        if os.path.splitext(self.output_file)[1].lower() == ".png":
+            with open(self.output_file, "wb") as f:
+                writer = PNGBandWriter(f, image_width, image_height)
+                sum_red_pixels = 0
+                for _, band in iter_image_bands(self.input_file, self.tile_height):
+                    new_band = np.asarray(band, dtype=np.uint8) + np.uint8(n % 256)
+                    sum_red_pixels += int(new_band[:, :, 0].sum(dtype=np.uint64))
+                    writer.write_band(new_band)
+                writer.close()
+            return sum_red_pixels
+
+        output_dir = os.path.dirname(self.output_file) or "."
+        with tempfile.TemporaryDirectory(dir=output_dir) as buffer_dir:
+            with open(os.path.join(buffer_dir, "pixels.raw"), "w+b") as buffer_file:
+                # Pillow can use an RGBX buffer in place without copying it, and
+                # save JPEG, TIFF and WebP images from it
+                buffer_file.truncate(image_width * image_height * 4)
+                buffer = mmap.mmap(buffer_file.fileno(), 0)
+                new_pixels = np.frombuffer(buffer, dtype=np.uint8).reshape(
+                    image_height, image_width, 4
+                )
+
+                sum_red_pixels = 0
+                for top, band in iter_image_bands(self.input_file, self.tile_height):
+                    bottom = top + band.height
+                    np.add(
+                        np.asarray(band, dtype=np.uint8),
+                        np.uint8(n % 256),
+                        out=new_pixels[top:bottom, :, :3],
+                    )
+                    sum_red_pixels += int(
+                        new_pixels[top:bottom, :, 0].sum(dtype=np.uint64)
+                    )
+                    release_pages(buffer)
+
+                new_image = Image.frombuffer(
+                    "RGBX", (image_width, image_height), buffer, "raw", "RGBX", 0, 1
+                )
+                output_format = Image.registered_extensions().get(
+                    os.path.splitext(self.output_file)[1].lower()
+                )
+                with open(self.output_file, "wb") as f:
+                    new_image.save(PageReleasingWriter(f, buffer), format=output_format)
+
+                # Release the buffer so the temporary directory can be removed
+                del new_image, new_pixels
+                buffer.close()
+
+        return sum_red_pixels
+
+    def red_sums_for_all_numbers(self, n_values=range(50, 160)):
+        """
+        Calculates the sum of all red pixel values of the new image for every
+        possible generated number, decoding the image only once.
+
+        Args:
+            n_values (iterable): The numbers to calculate the red sum for. Defaults to
+                every number `generate_number` can return.
+
+        Returns:
+            dict: The red sum for each number, or None if the input file is missing.
+        """
+        # Check if the input file exists
+        if not os.path.isfile(self.input_file):
+            print(f"Error: The file '{self.input_file}' does not exist.")
+            return None
+
+        image = Image.open(self.input_file).convert("RGB")
+
+        # The first 256 bins of an RGB histogram are the red channel
+        red_histogram = np.array(image.histogram()[:256], dtype=np.int64)
+        return self.red_sums_from_histogram(red_histogram, n_values)
+
+    @staticmethod
+    def red_sums_from_histogram(red_histogram, n_values):
+        """
+        Calculates the exact red sum for each number from the red channel histogram.
+        A red value v becomes (v + n) % 256, so the red sum for n is the number of
+        pixels with each value times its shifted value.
+
+        Args:
+            red_histogram (ndarray): The 256-bin red channel histogram.
+            n_values (iterable): The numbers to calculate the red sum for.
+
+        Returns:
+            dict: The red sum for each number.
+        """
+        n_values = list(n_values)
+        shifted_values = (np.arange(256) + np.array(n_values)[:, None]) % 256
+        red_sums = shifted_values @ red_histogram
+        return {n: int(red_sum) for n, red_sum in zip(n_values, red_sums)}
+
+    @staticmethod
+    def generate_number():
+        """
+        Generates the number to add to each pixel value based on the current time.
+
+        Returns:
+            int: The generated number.
+        """
         generated_number = (int(time.time()) % 100) + 50
         generated_number += 10 if generated_number % 2 == 0 else 0
+        return generated_number
 
-        # Load and convert the image to RGB
-        image = Image.open(self.input_file).convert("RGB")
+    @staticmethod
+    def shift_pixels_python(image, n):
+        """
+        Adds n to every pixel value, wrapping around 256, one pixel at a time.
+
+        Args:
+            image (Image): The RGB image to modify.
+            n (int): The number to add to each pixel value.
+
+        Returns:
+            tuple: The modified image and the sum of its red pixel values.
+        """
         image_width, image_height = image.size
         pixels = image.load()
 
@@ -49,9 +248,6 @@ class ImageModifier:
         new_image = Image.new("RGB", (image_width, image_height))
         new_pixels = new_image.load()
 
-        n = generated_number
-
-        # Modify each pixel and calculate the sum of all red pixels simultaneously
         sum_red_pixels = 0
         for i in range(image_width):
             for j in range(image_height):
@@ -65,7 +261,422 @@ class ImageModifier:
                 new_pixels[i, j] = (r, g, b)
                 sum_red_pixels += r
 
-        # Save the new image
-        new_image.save(self.output_file)
-        print(f"Image saved to {self.output_file}")
-        print(f"The sum of all red pixels is: {sum_red_pixels}")
+        return new_image, sum_red_pixels
+
+    @staticmethod
+    def shift_pixels_numpy(image, n):
+        """
+        Adds n to every pixel value, wrapping around 256, on the whole pixel array
+        at once. The results are identical to `shift_pixels_python`.
+
+        Args:
+            image (Image): The RGB image to modify.
+            n (int): The number to add to each pixel value.
+
+        Returns:
+            tuple: The modified image and the sum of its red pixel values.
+        """
+        pixels = np.asarray(image, dtype=np.uint8)
+
+        # uint8 addition wraps around 256, which is the same as (v + n) % 256
+        new_pixels = pixels + np.uint8(n % 256)
+        sum_red_pixels = int(new_pixels[:, :, 0].sum(dtype=np.uint64))
+
+        return Image.fromarray(new_pixels), sum_red_pixels
+
+
+class ImageBatchModifier:
+    """
+    A class to apply the ImageModifier transform to many images in parallel and
+    report the red pixel sum of each new image in a CSV file.
+    """
+
+    image_extensions = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff")
+
+    def __init__(
+        self,
+        input_path,
+        output_dir,
+        n,
+        report_file,
+        workers=None,
+        engine="numpy",
+        tile_height=None,
+    ):
+        """
+        Initialize the ImageBatchModifier instance.
+
+        Args:
+            input_path (str): Directory of images, or a glob pattern matching them.
+            output_dir (str): Directory where the modified images will be saved.
+            n (int): The number to add to each pixel value, so that results are
+                reproducible.
+            report_file (str): Path where the CSV report will be saved.
+            workers (int, optional): Number of worker processes. Defaults to the
+                number of CPUs.
+            engine (str): How to modify the pixels ('numpy' or 'python').
+            tile_height (int, optional): Band height for processing the images in
+                bands.
+        """
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.n = n
+        self.report_file = report_file
+        self.workers = workers
+        self.engine = engine
+        self.tile_height = tile_height
+
+    def list_images(self):
+        """
+        Lists the images to modify, in sorted order.
+
+        Returns:
+            list: The image paths.
+        """
+        if os.path.isdir(self.input_path):
+            paths = [
+                os.path.join(self.input_path, file)
+                for file in os.listdir(self.input_path)
+            ]
+        else:
+            paths = glob.glob(self.input_path)
+
+        return sorted(
+            path
+            for path in paths
+            if os.path.isfile(path) and path.lower().endswith(self.image_extensions)
+        )
+
+    def modify_images(self):
+        """
+        Modifies every image in a process pool, saves the new images to the output
+        directory and writes the red pixel sum and timing of each image to the
+        CSV report.
+
+        The new images keep their paths relative to the folder holding all the
+        inputs, so images with the same name in different folders do not overwrite
+        each other. An image whose output would overwrite an input image is skipped,
+        and an image that cannot be read or modified is recorded as failed in the
+        report without stopping the others.
+
+        Returns:
+            list: A (image, output, red sum, seconds, error) tuple for each image.
+                The red sum and seconds are None and the error is set if the image
+                failed.
+        """
+        image_paths = self.list_images()
+        if not image_paths:
+            print(f"Error: No images found for '{self.input_path}'.")
+            return []
+
+        # Check if the output directories exist, create them if not
+        for directory in (self.output_dir, os.path.dirname(self.report_file)):
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+                print(f"Created the output directory: {directory}")
+
+        output_paths = self.get_output_paths(image_paths)
+        input_files = {os.path.normcase(os.path.abspath(path)) for path in image_paths}
+
+        results = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for input_file, output_file in zip(image_paths, output_paths):
+                if os.path.normcase(os.path.abspath(output_file)) in input_files:
+                    continue
+                output_subdir = os.path.dirname(output_file)
+                if output_subdir and not os.path.exists(output_subdir):
+                    os.makedirs(output_subdir)
+                futures[input_file] = executor.submit(
+                    modify_image_worker,
+                    input_file,
+                    output_file,
+                    self.n,
+                    self.engine,
+                    self.tile_height,
+                )
+
+            for input_file, output_file in zip(image_paths, output_paths):
+                future = futures.get(input_file)
+                if future is None:
+                    error = "The output would overwrite an input image"
+                    print(f"Error processing {input_file}: {error}. Skipping it.")
+                    results.append((input_file, output_file, None, None, error))
+                    continue
+                try:
+                    sum_red_pixels, elapsed = future.result()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    print(f"Error processing {input_file}: {error}")
+                    results.append((input_file, output_file, None, None, error))
+                else:
+                    results.append(
+                        (input_file, output_file, sum_red_pixels, elapsed, "")
+                    )
+
+        # Write the results to a CSV file
+        with open(self.report_file, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Image", "Output", "Red Sum", "Seconds", "Error"])
+            for input_file, output_file, sum_red_pixels, elapsed, error in results:
+                writer.writerow(
+                    [
+                        input_file,
+                        output_file,
+                        "" if sum_red_pixels is None else sum_red_pixels,
+                        "" if elapsed is None else f"{elapsed:.4f}",
+                        error,
+                    ]
+                )
+
+        failed = sum(1 for result in results if result[4])
+        print(f"Modified {len(results) - failed} images with n = {self.n}")
+        if failed:
+            print(f"{failed} image(s) failed; see the report for the errors")
+        print(f"Report saved to {self.report_file}")
+        return results
+
+    def get_output_paths(self, image_paths):
+        """
+        Maps each image to its output path, keeping its path relative to the
+        input directory, or to the deepest folder holding all the images matched
+        by a glob pattern.
+
+        Args:
+            image_paths (list): The image paths.
+
+        Returns:
+            list: The output paths, in the same order.
+        """
+        if os.path.isdir(self.input_path):
+            root = self.input_path
+        else:
+            root = os.path.commonpath(
+                [os.path.dirname(os.path.abspath(path)) for path in image_paths]
+            )
+        return [
+            os.path.join(self.output_dir, os.path.relpath(os.path.abspath(path), root))
+            for path in image_paths
+        ]
+
+
+def modify_image_worker(input_file, output_file, n, engine, tile_height):
+    """
+    Modifies a single image. Runs in a worker process.
+
+    Args:
+        input_file (str): Path to the input image file.
+        output_file (str): Path where the modified image will be saved.
+        n (int): The number to add to each pixel value.
+        engine (str): How to modify the pixels ('numpy' or 'python').
+        tile_height (int): Band height for processing the image in bands, or None.
+
+    Returns:
+        tuple: The sum of all red pixel values and the time taken in seconds.
+    """
+    start_time = time.perf_counter()
+    modifier = ImageModifier(input_file, output_file, engine, tile_height)
+    sum_red_pixels = modifier.modify_image(n)
+    return sum_red_pixels, time.perf_counter() - start_time
+
+
+def iter_image_bands(input_file, tile_height):
+    """
+    Reads an image as RGB bands of `tile_height` rows, from top to bottom.
+
+    Uncompressed images (such as many TIFF, BMP and PPM files) are decoded one band
+    at a time, reading only the bytes of the rows the band covers. Pillow can only
+    decode compressed images, such as JPEG and PNG files, in one piece, so they are
+    decoded once and the bands are cut from the decoded image.
+
+    Args:
+        input_file (str): Path to the image file.
+        tile_height (int): Number of rows per band.
+
+    Yields:
+        tuple: The top row of the band and the band as an RGB image.
+    """
+    with Image.open(input_file) as image:
+        mode = image.mode
+        image_width, image_height = image.size
+        tiles = raw_tiles(image, tile_height)
+
+        if tiles is None:
+            image.load()
+            for top in range(0, image_height, tile_height):
+                bottom = min(top + tile_height, image_height)
+                yield top, image.crop((0, top, image_width, bottom)).convert("RGB")
+            return
+
+    with open(input_file, "rb") as f:
+        for top in range(0, image_height, tile_height):
+            bottom = min(top + tile_height, image_height)
+            band = Image.new(mode, (image_width, bottom - top))
+            for (x0, y0, x1, y1), offset, rawmode, stride, orientation in tiles:
+                if y0 >= bottom or y1 <= top:
+                    continue
+                f.seek(offset)
+                tile = Image.frombytes(
+                    mode,
+                    (x1 - x0, y1 - y0),
+                    f.read(stride * (y1 - y0)),
+                    "raw",
+                    rawmode,
+                    stride,
+                    orientation,
+                )
+                band.paste(tile, (x0, y0 - top))
+            yield top, band.convert("RGB")
+
+
+def raw_tiles(image, tile_height):
+    """
+    Finds where the rows of an uncompressed image are stored, so that it can be
+    read in bands. An image stored as one block of rows is split into tiles of
+    `tile_height` rows.
+
+    Args:
+        image (Image): The opened, not yet loaded image.
+        tile_height (int): Number of rows per tile when splitting.
+
+    Returns:
+        list: The (extents, offset, raw mode, stride, orientation) of each tile,
+            or None if the image is compressed or its layout is not supported.
+    """
+    # Modes that convert to RGB without a palette
+    if image.mode not in ("L", "RGB", "RGBA", "RGBX", "CMYK"):
+        return None
+
+    tiles = []
+    for name, extents, offset, args in image.tile:
+        if name != "raw":
+            return None
+        x0, y0, x1, y1 = extents
+        if x0 < 0 or y0 < 0 or x1 > image.width or y1 > image.height:
+            return None
+
+        if isinstance(args, str):
+            args = (args,)
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if not stride:
+            # Without padding, these raw modes hold one byte per band in each row
+            if rawmode not in ("L", "RGB", "RGBA", "RGBX", "CMYK"):
+                return None
+            stride = (x1 - x0) * len(rawmode)
+        tiles.append(((x0, y0, x1, y1), offset, rawmode, stride, orientation))
+
+    if len(tiles) != 1:
+        return tiles
+
+    # Split a single block of rows into tiles of `tile_height` rows
+    (x0, y0, x1, y1), offset, rawmode, stride, orientation = tiles[0]
+    split_tiles = []
+    for top in range(y0, y1, tile_height):
+        bottom = min(top + tile_height, y1)
+        # Rows stored bottom-up have the last row first in the file
+        first_row = top - y0 if orientation > 0 else y1 - bottom
+        split_tiles.append(
+            (
+                (x0, top, x1, bottom),
+                offset + stride * first_row,
+                rawmode,
+                stride,
+                orientation,
+            )
+        )
+    return split_tiles
+
+
+def release_pages(buffer):
+    """
+    Releases the pages of a file-backed memory map from the memory of the process.
+    The data stays in the file, and is read back from the page cache if the
+    pages are used again. Does nothing where the platform does not support it.
+
+    Args:
+        buffer (mmap): The memory map.
+    """
+    if hasattr(mmap, "MADV_DONTNEED"):
+        buffer.madvise(mmap.MADV_DONTNEED)
+
+
+class PageReleasingWriter:
+    """
+    A wrapper for an output file that releases the pages of a memory-mapped image
+    buffer each time the encoder writes out a block of the image, so that the
+    pages the encoder has read do not build up in memory.
+    """
+
+    def __init__(self, f, buffer):
+        self.f = f
+        self.buffer = buffer
+
+    def write(self, data):
+        release_pages(self.buffer)
+        return self.f.write(data)
+
+    def fileno(self):
+        # Without a file descriptor, Pillow's encoders write their output one
+        # block at a time through `write`
+        raise io.UnsupportedOperation("fileno")
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class PNGBandWriter:
+    """
+    A class to write an 8-bit RGB PNG file one band of rows at a time, compressing
+    each band as it arrives. Each row uses the PNG 'Sub' filter.
+    """
+
+    signature = b"\x89PNG\r\n\x1a\n"
+
+    def __init__(self, f, width, height, compress_level=6):
+        """
+        Initialize the PNGBandWriter instance and write the PNG header.
+
+        Args:
+            f (file): The output file opened in binary mode.
+            width (int): The image width.
+            height (int): The image height.
+            compress_level (int): The zlib compression level.
+        """
+        self.f = f
+        self.compressor = zlib.compressobj(compress_level)
+        f.write(self.signature)
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def write_band(self, pixels):
+        """
+        Compresses and writes the next rows of the image.
+
+        Args:
+            pixels (ndarray): The rows as a (rows, width, 3) uint8 array.
+        """
+        # The 'Sub' filter stores each byte minus the same byte of the pixel to its
+        # left, wrapping around 256
+        filtered = pixels.copy()
+        filtered[:, 1:] -= pixels[:, :-1]
+
+        rows = np.empty((pixels.shape[0], pixels.shape[1] * 3 + 1), dtype=np.uint8)
+        rows[:, 0] = 1
+        rows[:, 1:] = filtered.reshape(pixels.shape[0], -1)
+
+        data = self.compressor.compress(rows.tobytes())
+        if data:
+            self.write_chunk(b"IDAT", data)
+
+    def close(self):
+        """
+        Writes the rest of the compressed data and the end of the PNG file.
+        """
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+
+    def write_chunk(self, chunk_type, data):
+        """
+        Writes a PNG chunk with its length and CRC.
+        """
+        self.f.write(struct.pack(">I", len(data)) + chunk_type + data)
+        self.f.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
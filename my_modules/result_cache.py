@@ -0,0 +1,213 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from collections import Counter
+
+from my_modules.heavy_hitters import SpaceSaving
+from my_modules.helper import hash_file
+
+
+class ResultCache:
+    """
+    A class to store count tables on disk, keyed by the content of the input file
+    and the settings used to compute them, so that repeat runs can skip the work.
+
+    Entries are gzipped JSON files. When the cache grows beyond `max_bytes`, the
+    least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        """
+        Initialize the ResultCache instance.
+
+        Args:
+            cache_dir (str): Directory where the cache entries are stored.
+            max_bytes (int): Maximum total size of the cache entries in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.file_hashes_path = os.path.join(cache_dir, "file_hashes.json")
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def file_hash(self, file_path):
+        """
+        Returns the SHA-256 hash of a file's content. The hash is remembered along
+        with the file's size and modification time, so an unchanged file is only
+        hashed once.
+
+        Args:
+            file_path (str): Path to the file.
+
+        Returns:
+            str: The hex digest.
+        """
+        stat = os.stat(file_path)
+        file_key = os.path.abspath(file_path)
+
+        file_hashes = self.read_json(self.file_hashes_path) or {}
+        entry = file_hashes.get(file_key)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["sha256"]
+
+        digest = hash_file(file_path)
+        file_hashes[file_key] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": digest,
+        }
+        self.write_json(self.file_hashes_path, file_hashes)
+        return digest
+
+    def input_hash(self, file_path, text=None):
+        """
+        Returns the SHA-256 hash of a task's input: of the text if it is already in
+        memory, which may differ from the file, and otherwise of the file.
+
+        Args:
+            file_path (str): Path to the input file.
+            text (str, optional): The input text, if it is already in memory.
+
+        Returns:
+            str: The hex digest.
+        """
+        if text is not None:
+            return hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return self.file_hash(file_path)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Builds a cache key from the parts that determine a result.
+
+        Args:
+            *parts: JSON-serializable values, such as a content hash, a model name
+                and a library version.
+
+        Returns:
+            str: The cache key.
+        """
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a cached result.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict: The cached result, or None if it is not cached.
+        """
+        entry_path = self.entry_path(key)
+        try:
+            with gzip.open(entry_path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used
+        os.utime(entry_path)
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a result and evicts the least recently used entries if the cache is
+        over its size limit.
+
+        Args:
+            key (str): The cache key.
+            value (dict): The JSON-serializable result.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(temp_path, self.entry_path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in `max_bytes`.
+        """
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith(".json.gz"):
+                stat = os.stat(os.path.join(self.cache_dir, file))
+                entries.append((stat.st_mtime, stat.st_size, file))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, file))
+            total_size -= size
+
+    def entry_path(self, key):
+        """
+        Returns the path of the cache entry for a key.
+        """
+        return os.path.join(self.cache_dir, f"{key}.json.gz")
+
+    @staticmethod
+    def read_json(path):
+        """
+        Reads a JSON file, returning None if it is missing or invalid.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_json(self, path, value):
+        """
+        Writes a JSON file atomically through a temporary file in the cache directory.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+
+
+def serialize_counts(counts):
+    """
+    Converts a count table to a JSON-serializable dict, keeping the order of the
+    entries so that ties sort the same way when it is loaded again.
+
+    Args:
+        counts (Counter or SpaceSaving): The count table.
+
+    Returns:
+        dict: The serialized count table.
+    """
+    if isinstance(counts, SpaceSaving):
+        return {
+            "capacity": counts.capacity,
+            "total": counts.total,
+            "counts": list(counts.counts.items()),
+            "errors": list(counts.errors.items()),
+        }
+    return {"counts": list(counts.items())}
+
+
+def deserialize_counts(value):
+    """
+    Converts a dict created by `serialize_counts` back to a count table.
+
+    Args:
+        value (dict): The serialized count table.
+
+    Returns:
+        Counter or SpaceSaving: The count table.
+    """
+    if "capacity" not in value:
+        return Counter(dict(value["counts"]))
+
+    counts = SpaceSaving(value["capacity"])
+    counts.update(dict(value["counts"]))
+    counts.errors = dict(value["errors"])
+    counts.total = value["total"]
+    return counts
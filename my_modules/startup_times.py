@@ -0,0 +1,117 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# The menu itself, followed by the modules it imports when a task runs
+STARTUP_MODULES = [
+    "main",
+    "my_modules.q1_t1_extract_text",
+    "my_modules.q1_t2_research",
+    "my_modules.q1_t3_1_most_common_words",
+    "my_modules.q1_t3_2_most_common_tokens",
+    "my_modules.q1_t3_text_analytics",
+    "my_modules.q1_t4_named_entity_recognition",
+    "my_modules.q2_c1_gatekeeper",
+    "my_modules.q2_c2_chamber_of_strings",
+    "my_modules.q3_encrypted",
+]
+
+# Imports a module in a fresh interpreter and prints the seconds it took and the
+# peak resident memory in bytes, where the platform reports it
+MEASURE_IMPORT_CODE = """
+import importlib, json, sys, time
+start_time = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start_time
+try:
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss *= 1 if sys.platform == "darwin" else 1024
+except ImportError:
+    max_rss = None
+print(json.dumps({"seconds": seconds, "max_rss": max_rss}))
+"""
+
+
+def measure_import_time(module, repeat=3, cwd=None):
+    """
+    Measures how long a module takes to import in a fresh interpreter, so that
+    modules already imported by the caller do not hide the cost.
+
+    Args:
+        module (str): The dotted name of the module.
+        repeat (int): Number of fresh interpreters to measure the import in. The
+            fastest run is kept, as the others include disk cache misses.
+        cwd (str, optional): Directory to run the interpreters in, where the
+            module can be imported from.
+
+    Returns:
+        dict: The import time in seconds and the peak resident memory in bytes,
+            or an error message if the module failed to import.
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", MEASURE_IMPORT_CODE, module],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            error_lines = result.stderr.strip().splitlines()
+            return {"error": error_lines[-1] if error_lines else "import failed"}
+
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or measurement["seconds"] < best["seconds"]:
+            best = measurement
+    return best
+
+
+def measure_import_times(output_file, modules=None, repeat=3, cwd=None):
+    """
+    Measures the import time and memory of the menu and each task module, prints
+    them, and appends them as a JSON line to the output file so that the cost can
+    be tracked over time.
+
+    Args:
+        output_file (str): Path of the JSON lines file to append to.
+        modules (list, optional): The modules to measure. Defaults to
+            STARTUP_MODULES.
+        repeat (int): Number of fresh interpreters to measure each module in.
+        cwd (str, optional): Directory to run the interpreters in.
+
+    Returns:
+        dict: The record appended to the output file.
+    """
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "modules": {},
+    }
+
+    print(f"{'Seconds':>8} {'RSS (MB)':>9}  Module")
+    for module in modules or STARTUP_MODULES:
+        measurement = measure_import_time(module, repeat, cwd)
+        record["modules"][module] = measurement
+
+        if "error" in measurement:
+            print(f"{'-':>8} {'-':>9}  {module} ({measurement['error']})")
+        else:
+            max_rss = measurement["max_rss"]
+            rss_text = f"{max_rss / (1024 * 1024):.1f}" if max_rss else "-"
+            print(f"{measurement['seconds']:>8.3f} {rss_text:>9}  {module}")
+
+    # Check if the output directory exists; create it if not
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    with open(output_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Import times appended to {output_file}")
+
+    return record